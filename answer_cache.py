@@ -0,0 +1,99 @@
+import math
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+
+@dataclass
+class CachedAnswer:
+    context_key: Tuple[str, ...]
+    vector: List[float]
+    answer: str
+    sources: List[Dict]
+    created: float
+
+
+class AnswerCache:
+    # Answers keyed by question embedding and the exact set of retrieved
+    # chunk IDs. A hit needs identical context and cosine similarity of at
+    # least `threshold` between the question embeddings.
+    def __init__(self, threshold: float = 0.95, ttl_seconds: float = 3600, max_entries: int = 256):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        self.by_context: Dict[Tuple[str, ...], Set[int]] = {}
+        self.next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def context_key(chunk_ids: List[str]) -> Tuple[str, ...]:
+        return tuple(sorted(chunk_ids))
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> List[float]:
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def lookup(self, vector: List[float], chunk_ids: List[str]) -> Optional[CachedAnswer]:
+        key = self.context_key(chunk_ids)
+        vector = self._normalize(vector)
+        now = time.time()
+        with self.lock:
+            best, best_score = None, self.threshold
+            for entry_id in list(self.by_context.get(key, ())):
+                entry = self.entries[entry_id]
+                if now - entry.created > self.ttl_seconds:
+                    self._remove(entry_id)
+                    continue
+                score = sum(a * b for a, b in zip(vector, entry.vector))
+                if score >= best_score:
+                    best, best_score = entry_id, score
+
+            if best is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(best)
+            self.hits += 1
+            return self.entries[best]
+
+    def store(self, vector: List[float], chunk_ids: List[str], answer: str, sources: List[Dict]) -> None:
+        key = self.context_key(chunk_ids)
+        with self.lock:
+            entry_id = self.next_id
+            self.next_id += 1
+            self.entries[entry_id] = CachedAnswer(key, self._normalize(vector), answer, sources, time.time())
+            self.by_context.setdefault(key, set()).add(entry_id)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self.entries.pop(entry_id)
+        ids = self.by_context[entry.context_key]
+        ids.discard(entry_id)
+        if not ids:
+            del self.by_context[entry.context_key]
+
+    def invalidate(self, *_) -> None:
+        # Registered as a VectorstoreManager listener: any add or delete of
+        # chunks drops every cached answer.
+        with self.lock:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.by_context.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+            "invalidations": self.invalidations,
+        }
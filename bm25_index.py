@@ -0,0 +1,142 @@
+import os
+import re
+import math
+import heapq
+import sqlite3
+import threading
+from collections import Counter
+from typing import Iterable, List, Tuple
+from utils import batched
+
+LOOKUP_BATCH = 500
+
+TOKEN_RE = re.compile(r"\w+(?:[-./:]\w+)*")
+PART_RE = re.compile(r"[-./:_]")
+
+
+def tokenize(text: str) -> List[str]:
+    # Identifiers such as ERR-404, v2.3.1 or part_no_77 are indexed whole and
+    # also by their parts, so both exact and partial mentions match.
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower()):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in PART_RE.split(token) if part)
+    return tokens
+
+
+class BM25Index:
+    # Persisted inverted index over chunk text. Postings, document frequencies
+    # and lengths are precomputed at ingestion, so a query reads only the
+    # postings of its own terms. Kept in sync through VectorstoreManager
+    # listeners as chunk IDs are added or removed.
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75, max_df_ratio: float = 0.5):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        # Terms found in more than this share of chunks add little but cost
+        # the most to score, so queries skip them.
+        self.max_df_ratio = max_df_ratio
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS docs (doc INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, "
+            "length INTEGER NOT NULL, terms TEXT NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, doc INTEGER NOT NULL, tf INTEGER NOT NULL, "
+            "PRIMARY KEY (term, doc)) WITHOUT ROWID"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID")
+        self.conn.commit()
+        self.n_docs, self.total_length = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs").fetchone()
+
+    def is_empty(self) -> bool:
+        return self.n_docs == 0
+
+    def update(self, added, removed_ids: List[str]) -> None:
+        # VectorstoreManager listener signature: (added_chunks, removed_ids).
+        if removed_ids:
+            self.remove(removed_ids)
+        if added:
+            self.add((doc.metadata["id"], doc.page_content) for doc in added)
+
+    def add(self, items: Iterable[Tuple[str, str]]) -> None:
+        # Chunk IDs include a content hash, so an ID already indexed never
+        # needs re-indexing. Writes are batched per call: one postings insert
+        # and one document-frequency update for the whole batch.
+        items = dict(items)
+        with self.lock:
+            for batch in batched(list(items), LOOKUP_BATCH):
+                for (chunk_id,) in self.conn.execute(
+                    f"SELECT id FROM docs WHERE id IN ({','.join('?' * len(batch))})", batch
+                ):
+                    del items[chunk_id]
+            postings, df = [], Counter()
+            for chunk_id, text in items.items():
+                counts = Counter(tokenize(text))
+                length = sum(counts.values())
+                # Each doc keeps its term list so removal can delete its
+                # postings by primary key without a second index.
+                doc = self.conn.execute(
+                    "INSERT INTO docs (id, length, terms) VALUES (?, ?, ?)", (chunk_id, length, "\n".join(counts))
+                ).lastrowid
+                postings.extend((term, doc, tf) for term, tf in counts.items())
+                df.update(counts.keys())
+                self.n_docs += 1
+                self.total_length += length
+            postings.sort()
+            self.conn.executemany("INSERT INTO postings (term, doc, tf) VALUES (?, ?, ?)", postings)
+            self.conn.executemany(
+                "INSERT INTO terms (term, df) VALUES (?, ?) ON CONFLICT (term) DO UPDATE SET df = df + excluded.df",
+                sorted(df.items())
+            )
+            self.conn.commit()
+
+    def remove(self, chunk_ids: Iterable[str]) -> None:
+        with self.lock:
+            for chunk_id in chunk_ids:
+                row = self.conn.execute("SELECT doc, length, terms FROM docs WHERE id = ?", (chunk_id,)).fetchone()
+                if row is None:
+                    continue
+                doc, length, terms = row
+                terms = terms.split("\n") if terms else []
+                self.conn.executemany("UPDATE terms SET df = df - 1 WHERE term = ?", [(term,) for term in terms])
+                self.conn.executemany("DELETE FROM postings WHERE term = ? AND doc = ?", [(term, doc) for term in terms])
+                self.conn.execute("DELETE FROM docs WHERE doc = ?", (doc,))
+                self.n_docs -= 1
+                self.total_length -= length
+            self.conn.execute("DELETE FROM terms WHERE df <= 0")
+            self.conn.commit()
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        terms = set(tokenize(query))
+        if not terms or not self.n_docs:
+            return []
+        scores = Counter()
+        with self.lock:
+            n_docs = self.n_docs
+            avg_length = self.total_length / n_docs
+            for term in terms:
+                row = self.conn.execute("SELECT df FROM terms WHERE term = ?", (term,)).fetchone()
+                if row is None or (n_docs > 1 and row[0] > self.max_df_ratio * n_docs):
+                    continue
+                df = row[0]
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                for doc, tf, length in self.conn.execute(
+                    "SELECT p.doc, p.tf, d.length FROM postings p JOIN docs d ON d.doc = p.doc WHERE p.term = ?", (term,)
+                ):
+                    norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[doc] += idf * tf * (self.k1 + 1) / (tf + norm)
+            top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            ids = {
+                doc: chunk_id for doc, chunk_id in self.conn.execute(
+                    f"SELECT doc, id FROM docs WHERE doc IN ({','.join('?' * len(top))})", [doc for doc, _ in top]
+                )
+            } if top else {}
+        return [(ids[doc], score) for doc, score in top]
+
+    def close(self) -> None:
+        self.conn.close()
@@ -1,13 +1,32 @@
-from typing import Tuple, List, Dict
+import time
+from typing import Tuple, List, Dict, Iterator, Any, Optional
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.runnables import RunnableLambda, RunnableMap, Runnable
+from langchain_core.runnables import Runnable
 from langchain_core.documents import Document
 from langchain_core.memory import BaseMemory
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain.vectorstores.base import VectorStoreRetriever
 from langchain_core.language_models.chat_models import BaseChatModel
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 import yaml
+from answer_cache import AnswerCache
+from embedding_cache import CachedEmbeddings
+from dedup_index import references_of
+from context_compressor import ContextCompressor
+from question_rewriter import QuestionRewriter
+from history_manager import HistoryWindow
+from scheduler import GenerationScheduler
+
+
+class _StageTimer(BaseCallbackHandler):
+    # Marks the moment the formatted prompt reaches the LLM, splitting the
+    # combine-docs chain into prompt build and generation.
+    def __init__(self):
+        self.llm_start = None
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        if self.llm_start is None:
+            self.llm_start = time.perf_counter()
 
 
 class ChatAgent:
@@ -16,19 +35,42 @@ class ChatAgent:
         llm: BaseChatModel,
         retriever: VectorStoreRetriever,
         memory: BaseMemory,
-        config: dict
+        config: dict,
+        answer_cache: Optional[AnswerCache] = None,
+        scheduler: Optional[GenerationScheduler] = None,
+        session_id: Optional[str] = None,
+        question_rewriter: Optional[QuestionRewriter] = None
     ):
         self.llm = llm
         self.retriever = retriever
         self.memory = memory
         self.config = config
+        self.answer_cache = answer_cache
+        self.scheduler = scheduler
+        self.session_id = session_id
+        self.question_rewriter = question_rewriter
         self.prompts = self._load_prompts(config.get("prompt_path", "./prompts.yaml"))
+        self.history = HistoryWindow(llm, config, self.prompts["answer_prompt_system"])
+        self.compressor = self._create_compressor()
         self.chain = self._create_chain()
 
     def _load_prompts(self, prompt_path: str) -> dict:
         with open(prompt_path) as f:
             return yaml.safe_load(f)
 
+    def _create_compressor(self) -> Optional[ContextCompressor]:
+        # Reuses the retrieval embedding model, so it needs a vectorstore-backed
+        # retriever. Sentences skip the chunk embedding cache.
+        compression = self.config.get("compression", {})
+        embeddings = self._raw_embeddings()
+        if not compression.get("enabled", False) or embeddings is None:
+            return None
+        return ContextCompressor(
+            embeddings, self.history.count,
+            budget_tokens=compression.get("budget_tokens", 256),
+            prefill_tokens_per_s=compression.get("prefill_tokens_per_s"),
+        )
+
     def _create_chain(self) -> Runnable:
         answer_prompt = ChatPromptTemplate.from_messages([
             ("system", self.prompts["answer_prompt_system"]),
@@ -36,38 +78,314 @@ class ChatAgent:
             ("human", self.prompts["answer_prompt_human"]),
         ])
 
-        combine_docs_chain = create_stuff_documents_chain(
+        # Retrieval happens once in ask(); the chain only formats the
+        # retrieved documents into the prompt and generates. The system prompt
+        # and history come before the per-question context so that they form
+        # a prefix the llama.cpp KV cache can reuse across turns.
+        return create_stuff_documents_chain(
             llm=self.llm,
             prompt=answer_prompt
         )
 
-        question_only = RunnableLambda(lambda x: x["question"])
-        rag_chain = RunnableMap({
-            "context": question_only | self.retriever,
-            "question": lambda x: x["question"],
-            "chat_history": lambda x: x["chat_history"],
-        }) | combine_docs_chain
+    def ask(self, query: str) -> Tuple[str, List[Dict], Dict[str, float]]:
+        timings = {}
+        start = time.perf_counter()
+        question, query_vector = self._rewrite(query, timings)
+        retrieved_docs, query_vector = self._retrieve(question, timings, query_vector)
+
+        cached = self._cache_lookup(query_vector, retrieved_docs, timings)
+        if cached is not None:
+            timings["total"] = time.perf_counter() - start
+            self._remember(query, cached.answer)
+            return cached.answer, self._extract_sources(retrieved_docs), timings
+
+        context, spans = self._compress(query_vector, retrieved_docs, timings)
+        sources = self._extract_sources(retrieved_docs, spans)
+        answer = self._generate(self._chain_inputs(query, context, timings), timings)
+        timings["total"] = time.perf_counter() - start
+        self._report_compression(timings)
+
+        self._cache_store(query_vector, retrieved_docs, answer, sources)
+        self._remember(query, answer)
+        return answer, sources, timings
+
+    def ask_stream(self, query: str) -> Iterator[Tuple[str, Any]]:
+        # Yields ("sources", [...]) once retrieval finishes, then ("token", str)
+        # as the LLM produces text, and finally ("timings", {...}).
+        timings = {}
+        start = time.perf_counter()
+        question, query_vector = self._rewrite(query, timings)
+        retrieved_docs, query_vector = self._retrieve(question, timings, query_vector)
+
+        cached = self._cache_lookup(query_vector, retrieved_docs, timings)
+        if cached is not None:
+            yield "sources", self._extract_sources(retrieved_docs)
+            yield "token", cached.answer
+            timings["first_token"] = timings["total"] = time.perf_counter() - start
+            self._remember(query, cached.answer)
+            yield "timings", timings
+            return
+
+        context, spans = self._compress(query_vector, retrieved_docs, timings)
+        sources = self._extract_sources(retrieved_docs, spans)
+        yield "sources", sources
+
+        timer = _StageTimer()
+        chain_start = time.perf_counter()
+        first_token = None
+        tokens = []
+        for token in self.chain.stream(
+            self._chain_inputs(query, context, timings),
+            config={"callbacks": [timer]}
+        ):
+            if not token:
+                continue
+            if first_token is None:
+                first_token = time.perf_counter()
+            tokens.append(token)
+            yield "token", token
+        end = time.perf_counter()
+
+        llm_start = timer.llm_start or chain_start
+        timings["prompt"] = llm_start - chain_start
+        timings["generate"] = end - llm_start
+        timings["first_token"] = (first_token or end) - start
+        timings["total"] = end - start
+        timings.update(getattr(self.llm, "prompt_stats", {}))
+        if self.compressor is not None:
+            # Time to first token is prefill, so streamed answers keep the
+            # prefill rate behind the compression gain estimate current.
+            self.compressor.observe_prefill(timings.get("evaluated_tokens"), (first_token or end) - llm_start)
+        self._report_compression(timings)
+
+        answer = "".join(tokens)
+        self._cache_store(query_vector, retrieved_docs, answer, sources)
+        self._remember(query, answer)
+        yield "timings", timings
+
+    def ask_batch(self, queries: List[str]) -> List[Tuple[str, List[Dict], Dict[str, float]]]:
+        # Stateless bulk answering: no chat history is read or written. All
+        # questions are embedded in one call and searched in one vectorstore query.
+        # Each distinct (context, question) pair is generated once, and pairs
+        # sharing a context run back to back so llama.cpp reuses its prefix.
+        shared = {}
+        doc_lists, vectors = self._retrieve_batch(queries, shared)
+
+        groups: Dict[Tuple[str, ...], Dict[str, List[int]]] = {}
+        for i, (query, docs) in enumerate(zip(queries, doc_lists)):
+            context_key = tuple(doc.metadata.get("id", "") for doc in docs)
+            groups.setdefault(context_key, {}).setdefault(query.strip(), []).append(i)
+
+        results = [None] * len(queries)
+        for by_question in groups.values():
+            for question, indices in by_question.items():
+                docs = doc_lists[indices[0]]
+                query_vector = vectors[indices[0]] if vectors is not None else None
+                timings = dict(shared)
+                start = time.perf_counter()
+                cached = self._cache_lookup(query_vector, docs, timings)
+                if cached is not None:
+                    answer = cached.answer
+                    sources = self._extract_sources(docs)
+                else:
+                    context, spans = self._compress(query_vector, docs, timings)
+                    sources = self._extract_sources(docs, spans)
+                    answer = self._generate({"question": question, "chat_history": [], "context": context}, timings)
+                    self._report_compression(timings)
+                    self._cache_store(query_vector, docs, answer, sources)
+                timings["total"] = sum(shared.values()) + time.perf_counter() - start
+                for n, i in enumerate(indices):
+                    results[i] = (answer, sources, {**timings, "duplicate": int(n > 0)})
+        return results
+
+    def _retrieve_batch(self, queries: List[str], timings: Dict[str, float]) -> Tuple[List[List[Document]], Optional[List[List[float]]]]:
+        # Embed and search timings are amortised over the batch.
+        vectorstore = getattr(self.retriever, "vectorstore", None)
+        embeddings = self._raw_embeddings()
+        collection = getattr(vectorstore, "_collection", None)
+        search_batch = getattr(vectorstore, "search_batch", None)
+        if embeddings is None or (collection is None and search_batch is None) or not queries:
+            doc_lists, vectors = [], []
+            timings.update(embed=0.0, search=0.0)
+            for query in queries:
+                item = {}
+                docs, vector = self._retrieve(query, item)
+                doc_lists.append(docs)
+                vectors.append(vector)
+                timings["embed"] += item["embed"] / len(queries)
+                timings["search"] += item["search"] / len(queries)
+            return doc_lists, vectors
+
+        start = time.perf_counter()
+        # Questions go through the query path, as in _retrieve, and stay out
+        # of the chunk cache.
+        vectors = [embeddings.embed_query(query) for query in queries]
+        embedded = time.perf_counter()
+        k = self.retriever.search_kwargs.get("k", 4)
+        where = self.retriever.search_kwargs.get("filter")
+        if collection is not None:
+            result = collection.query(
+                query_embeddings=vectors, n_results=k, where=where, include=["documents", "metadatas"]
+            )
+            doc_lists = [
+                [Document(page_content=text, metadata=metadata or {}) for text, metadata in zip(texts, metadatas)]
+                for texts, metadatas in zip(result["documents"], result["metadatas"])
+            ]
+        else:
+            doc_lists = search_batch(vectors, k, where)
+        searched = time.perf_counter()
+        timings["embed"] = (embedded - start) / len(queries)
+        timings["search"] = (searched - embedded) / len(queries)
+        fuse = getattr(self.retriever, "fuse", None)
+        if fuse is not None:
+            doc_lists = [fuse(query, docs) for query, docs in zip(queries, doc_lists)]
+            timings["lexical"] = (time.perf_counter() - searched) / len(queries)
+        return doc_lists, vectors
+
+    def _raw_embeddings(self):
+        # The retrieval model without the chunk embedding cache, for texts
+        # that are not chunks and would only crowd it.
+        embeddings = getattr(getattr(self.retriever, "vectorstore", None), "embeddings", None)
+        return embeddings.embeddings if isinstance(embeddings, CachedEmbeddings) else embeddings
+
+    def _rewrite(self, query: str, timings: Dict[str, float]) -> Tuple[str, Optional[List[float]]]:
+        # Follow-ups are retrieved with a standalone rewrite of the question;
+        # the answer prompt keeps the question as asked, next to the history.
+        # Returns the question to retrieve with and, when the rewriter already
+        # embedded it, its vector.
+        if self.question_rewriter is None:
+            return query, None
+        embeddings = self._raw_embeddings()
+        vectors: Dict[str, List[float]] = {}
+
+        def embed_query(text: str) -> List[float]:
+            if text not in vectors:
+                vectors[text] = embeddings.embed_query(text)
+            return vectors[text]
+
+        def generate(prompt: str, max_tokens: int) -> str:
+            call = lambda: self.llm.invoke(prompt, max_tokens=max_tokens, stop=["\n"])
+            if self.scheduler is None:
+                return call()
+            return self.scheduler.run(self.session_id, call)[0]
+
+        start = time.perf_counter()
+        rewritten, changed = self.question_rewriter.rewrite(
+            query, self.memory.chat_memory.messages, generate, self.history.count,
+            embed_query if embeddings is not None else None
+        )
+        timings["rewrite"] = time.perf_counter() - start
+        timings["rewritten"] = int(changed)
+        return rewritten, vectors.get(rewritten)
+
+    def _generate(self, inputs: Dict, timings: Dict[str, float]) -> str:
+        # With a scheduler (server mode) the LLM call waits its turn in this
+        # session's queue, so concurrent sessions never drive llama.cpp at once.
+        def generate():
+            timer = _StageTimer()
+            chain_start = time.perf_counter()
+            answer = self.chain.invoke(inputs, config={"callbacks": [timer]})
+            end = time.perf_counter()
+            llm_start = timer.llm_start or chain_start
+            return answer, {
+                "prompt": llm_start - chain_start,
+                "generate": end - llm_start,
+                **getattr(self.llm, "prompt_stats", {})
+            }
 
-        return rag_chain
+        if self.scheduler is None:
+            answer, stats = generate()
+        else:
+            (answer, stats), timings["queue"] = self.scheduler.run(self.session_id, generate)
+        timings.update(stats)
+        return answer
 
-    def ask(self, query: str) -> Tuple[str, List[Dict]]:
-        # Run retriever manually for access to source docs
-        retrieved_docs = self.retriever.invoke(query)
+    def _compress(self, query_vector, docs: List[Document], timings: Dict[str, float]) -> Tuple[List[Document], Dict[str, List[List[int]]]]:
+        if self.compressor is None or query_vector is None or not docs:
+            return docs, {}
+        return self.compressor.compress(query_vector, docs, timings)
 
-        result = self.chain.invoke({
+    def _report_compression(self, timings: Dict[str, float]) -> None:
+        if self.compressor is not None and "context_tokens_full" in timings:
+            self.compressor.estimate_gain(timings)
+
+    def _chain_inputs(self, query: str, docs: List[Document], timings: Dict[str, float]) -> Dict:
+        chat_history, token_stats = self.history.select(self.memory.chat_memory.messages, query, docs)
+        timings.update(token_stats)
+        return {
             "question": query,
-            "chat_history": self.memory.chat_memory.messages,
-            "context": retrieved_docs
-        })
-
-        answer = result
-        sources = self._extract_sources(retrieved_docs)
-        return answer, sources
-
-    def _extract_sources(self, docs: List[Document]) -> List[Dict]:
-        return [{
-            "file": doc.metadata.get("file", "unknown"),
-            "page": doc.metadata.get("page", -1),
-            "chunk": doc.metadata.get("chunk", -1),
-            "text": doc.page_content.strip()
-        } for doc in docs]
+            "chat_history": chat_history,
+            "context": docs
+        }
+
+    def _remember(self, query: str, answer: str) -> None:
+        self.memory.chat_memory.add_user_message(query)
+        self.memory.chat_memory.add_ai_message(answer)
+
+    def _cache_lookup(self, query_vector, docs: List[Document], timings: Dict[str, float]):
+        if self.answer_cache is None or query_vector is None:
+            return None
+        start = time.perf_counter()
+        cached = self.answer_cache.lookup(query_vector, [doc.metadata.get("id", "") for doc in docs])
+        timings["cache"] = time.perf_counter() - start
+        return cached
+
+    def _cache_store(self, query_vector, docs: List[Document], answer: str, sources: List[Dict]) -> None:
+        if self.answer_cache is not None and query_vector is not None:
+            self.answer_cache.store(query_vector, [doc.metadata.get("id", "") for doc in docs], answer, sources)
+
+    def _retrieve(self, query: str, timings: Dict[str, float],
+                  query_vector: Optional[List[float]] = None) -> Tuple[List[Document], Optional[List[float]]]:
+        vectorstore = getattr(self.retriever, "vectorstore", None)
+        embeddings = getattr(vectorstore, "embeddings", None)
+        if embeddings is None:
+            start = time.perf_counter()
+            docs = self.retriever.invoke(query)
+            timings["embed"] = 0.0
+            timings["search"] = time.perf_counter() - start
+            return docs, None
+
+        start = time.perf_counter()
+        if query_vector is None:
+            query_vector = embeddings.embed_query(query)
+        embedded = time.perf_counter()
+        docs = vectorstore.similarity_search_by_vector(
+            query_vector, **self.retriever.search_kwargs
+        )
+        searched = time.perf_counter()
+        timings["embed"] = embedded - start
+        timings["search"] = searched - embedded
+        # Hybrid retrievers merge the dense hits with their lexical matches.
+        fuse = getattr(self.retriever, "fuse", None)
+        if fuse is not None:
+            docs = fuse(query, docs)
+            timings["lexical"] = time.perf_counter() - searched
+        return docs, query_vector
+
+    def _extract_sources(self, docs: List[Document], spans: Optional[Dict[str, List[List[int]]]] = None) -> List[Dict]:
+        # A deduplicated chunk also cites every other place its text occurs.
+        # With compression, `spans` are the (start, end) offsets into each
+        # chunk's text that reached the prompt.
+        sources = []
+        for doc in docs:
+            source = {
+                "id": doc.metadata.get("id", ""),
+                "file": doc.metadata.get("file", "unknown"),
+                "page": doc.metadata.get("page", -1),
+                "chunk": doc.metadata.get("chunk", -1),
+                "text": doc.page_content
+            }
+            if spans:
+                source["spans"] = spans.get(source["id"], [])
+            sources.append(source)
+            for reference in references_of(doc.metadata):
+                sources.append({
+                    "id": reference.get("id", ""),
+                    "file": reference.get("file", "unknown"),
+                    "page": reference.get("page", -1),
+                    "chunk": reference.get("chunk", -1),
+                    "text": source["text"],
+                    "duplicate_of": source["id"],
+                    **({"spans": source["spans"]} if "spans" in source else {}),
+                })
+        return sources
@@ -0,0 +1,119 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from utils import batched
+
+LOOKUP_BATCH = 500
+# user_version of indexes whose sources are manifest paths; older ones were
+# keyed by file name, which URL lists and same-named files share.
+SOURCE_VERSION = 1
+
+
+def source_of(metadata: Dict, data_path: str = "") -> str:
+    # The sync key of a chunk: the path the ingestion manifest tracks it
+    # under. Chunks stored before that was recorded only carry their file
+    # name; joined to `data_path` it matches the loader's path for local files.
+    return metadata.get("source_path") or os.path.join(data_path, metadata.get("file") or "")
+
+
+class ChunkIdIndex:
+    # Persisted set of chunk IDs stored in the vectorstore, grouped by source
+    # (see source_of). Lookups hit the primary-key B-tree, so checks cost
+    # O(ids asked).
+    def __init__(self, path: str, data_path: str = ""):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(chunks)")]
+        if not columns:
+            self.conn.execute(
+                "CREATE TABLE chunks (id TEXT PRIMARY KEY, source TEXT NOT NULL) WITHOUT ROWID"
+            )
+        elif "file" in columns:
+            self.conn.execute("DROP INDEX IF EXISTS chunks_file")
+            self.conn.execute("ALTER TABLE chunks RENAME COLUMN file TO source")
+            # File names become loader paths (see source_of) until a manifest re-keys them.
+            self.conn.execute("UPDATE chunks SET source = ? || source", (os.path.join(data_path, ""),))
+        self.conn.execute("CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source)")
+        self.conn.commit()
+
+    @staticmethod
+    def file_of(chunk_id: str) -> str:
+        # Chunk IDs are `file:page:hash`; page and hash never contain ':'.
+        return chunk_id.rsplit(":", 2)[0]
+
+    def has_legacy_sources(self) -> bool:
+        with self.lock:
+            return self.conn.execute("PRAGMA user_version").fetchone()[0] < SOURCE_VERSION
+
+    def is_empty(self) -> bool:
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM chunks LIMIT 1").fetchone() is None
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.conn.execute("DELETE FROM chunks")
+            self.conn.execute("PRAGMA user_version = 0")
+            self.conn.commit()
+
+    def __contains__(self, chunk_id: str) -> bool:
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM chunks WHERE id = ?", (chunk_id,)).fetchone() is not None
+
+    def missing(self, chunk_ids: Iterable[str]) -> List[str]:
+        chunk_ids = list(dict.fromkeys(chunk_ids))
+        found = set()
+        with self.lock:
+            for batch in batched(chunk_ids, LOOKUP_BATCH):
+                rows = self.conn.execute(
+                    f"SELECT id FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch
+                )
+                found.update(row[0] for row in rows)
+        return [chunk_id for chunk_id in chunk_ids if chunk_id not in found]
+
+    def ids_by_source(self, sources: Optional[Iterable[str]] = None) -> Dict[str, Set[str]]:
+        stored: Dict[str, Set[str]] = {}
+        with self.lock:
+            if sources is None:
+                rows = list(self.conn.execute("SELECT id, source FROM chunks"))
+            else:
+                rows = []
+                for batch in batched(sorted(set(sources)), LOOKUP_BATCH):
+                    rows.extend(self.conn.execute(
+                        f"SELECT id, source FROM chunks WHERE source IN ({','.join('?' * len(batch))})", batch
+                    ))
+        for chunk_id, source in rows:
+            stored.setdefault(source, set()).add(chunk_id)
+        return stored
+
+    def add(self, chunks: Iterable[Tuple[str, str]]) -> None:
+        # `chunks` are (chunk ID, source) pairs.
+        with self.lock:
+            self.conn.executemany(
+                "INSERT INTO chunks (id, source) VALUES (?, ?) ON CONFLICT (id) DO UPDATE SET source = excluded.source",
+                list(chunks)
+            )
+            self.conn.commit()
+
+    def set_sources(self, chunks: Iterable[Tuple[str, str]]) -> None:
+        # Re-keys stored chunks from (chunk ID, source) pairs and marks the
+        # index as keyed by manifest path.
+        with self.lock:
+            self.conn.executemany("UPDATE chunks SET source = ? WHERE id = ?", [(source, chunk_id) for chunk_id, source in chunks])
+            self.conn.execute(f"PRAGMA user_version = {SOURCE_VERSION}")
+            self.conn.commit()
+
+    def remove(self, chunk_ids: Iterable[str]) -> None:
+        with self.lock:
+            self.conn.executemany("DELETE FROM chunks WHERE id = ?", [(chunk_id,) for chunk_id in chunk_ids])
+            self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
@@ -0,0 +1,58 @@
+import re
+import zlib
+from typing import Iterable, List
+from langchain.docstore.document import Document
+
+WORD_RE = re.compile(r"\S+\s*")
+HEADING_RE = re.compile(r"(?:#{1,6}\s+\S|\d+(?:\.\d+)*\.?\s+[A-Z]|[A-Z][A-Z0-9 ,:&/-]{3,60}$)")
+HASH_MASK = 0xFFFFFFFF
+# A cut is taken where the rolling hash has these low bits clear: about one
+# word boundary in 32 and one paragraph end in 2.
+WORD_CUT_MASK = 31
+PARAGRAPH_CUT_MASK = 1
+
+
+def _is_heading(line: str) -> bool:
+    line = line.strip()
+    return 0 < len(line) <= 80 and bool(HEADING_RE.match(line)) and not line.endswith((".", ",", ";"))
+
+
+class ContentDefinedSplitter:
+    # Chunk boundaries are chosen from the text around them rather than from
+    # offsets: before headings, and where a rolling hash over the last ~32
+    # words hits a mask (paragraph ends much more often than other word
+    # breaks). An edit moves only the boundaries next to it, so the chunks
+    # after it keep their text and therefore their IDs. Chunks are between
+    # `min_size` and `chunk_size` characters and do not overlap.
+    def __init__(self, chunk_size: int = 800, min_size: int = None):
+        self.chunk_size = chunk_size
+        self.min_size = min(min_size or chunk_size // 2, chunk_size)
+
+    def split_text(self, text: str) -> List[str]:
+        chunks, start, length, rolling = [], 0, 0, 0
+        for match in WORD_RE.finditer(text):
+            word = match.group()
+            if length >= self.min_size // 2 and text[match.start() - 1] == "\n":
+                line_end = text.find("\n", match.start())
+                if _is_heading(text[match.start():line_end if line_end >= 0 else len(text)]):
+                    chunks.append(text[start:match.start()])
+                    start, length = match.start(), 0
+            if length and length + len(word.rstrip()) > self.chunk_size:
+                chunks.append(text[start:match.start()])
+                start, length = match.start(), 0
+
+            length += len(word)
+            rolling = ((rolling << 1) + zlib.crc32(word.rstrip().encode("utf-8"))) & HASH_MASK
+            mask = PARAGRAPH_CUT_MASK if "\n\n" in word else WORD_CUT_MASK
+            if length >= self.min_size and rolling & mask == 0:
+                chunks.append(text[start:match.end()])
+                start, length = match.end(), 0
+        chunks.append(text[start:])
+        return [chunk.strip() for chunk in chunks if chunk.strip()]
+
+    def split_documents(self, documents: Iterable[Document]) -> List[Document]:
+        return [
+            Document(page_content=chunk, metadata=dict(doc.metadata))
+            for doc in documents
+            for chunk in self.split_text(doc.page_content)
+        ]
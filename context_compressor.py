@@ -0,0 +1,115 @@
+import re
+import time
+import numpy as np
+from typing import Callable, Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+SENTENCE_RE = re.compile(r"[^.!?\n]+(?:[.!?]+[\"')\]]*|\n+|$)")
+# Fragments shorter than this (list markers, headings) are scored together
+# with the sentence that follows them.
+MIN_SENTENCE_CHARS = 24
+SPAN_SEPARATOR = " … "
+# Weight of each new prefill measurement in the running tokens/s estimate.
+PREFILL_SMOOTHING = 0.2
+
+
+def split_sentences(text: str) -> List[Tuple[int, int]]:
+    # (start, end) character offsets of each sentence, whitespace trimmed.
+    spans, start = [], None
+    for match in SENTENCE_RE.finditer(text):
+        segment = match.group()
+        if not segment.strip():
+            continue
+        begin = match.start() + len(segment) - len(segment.lstrip())
+        end = match.start() + len(segment.rstrip())
+        start = begin if start is None else start
+        if end - start >= MIN_SENTENCE_CHARS:
+            spans.append((start, end))
+            start = None
+    if start is not None:
+        if spans:
+            spans[-1] = (spans[-1][0], len(text.rstrip()))
+        else:
+            spans.append((start, len(text.rstrip())))
+    return spans
+
+
+class ContextCompressor:
+    # Cuts retrieved chunks down to their sentences most similar to the
+    # question before they are pasted into the prompt. All sentences of a
+    # question's chunks are embedded in one batch with the retrieval model and
+    # ranked by cosine similarity to the query vector; the best are kept until
+    # `budget_tokens` (counted with the LLM's tokenizer) is spent, then put
+    # back in document order. Kept text is returned as (start, end) offsets
+    # into each original chunk so sources can point at exactly what was used.
+    def __init__(self, embeddings: Embeddings, count_tokens: Callable[[str], int], budget_tokens: int = 256,
+                 prefill_tokens_per_s: Optional[float] = None):
+        self.embeddings = embeddings
+        self.count_tokens = count_tokens
+        self.budget_tokens = budget_tokens
+        # Measured from streamed answers unless configured; used to turn
+        # saved prompt tokens into an estimated latency change.
+        self.prefill_tokens_per_s = prefill_tokens_per_s
+
+    def compress(self, query_vector: List[float], docs: List[Document],
+                 timings: Dict[str, float]) -> Tuple[List[Document], Dict[str, List[List[int]]]]:
+        start = time.perf_counter()
+        full_tokens = sum(self.count_tokens(doc.page_content) for doc in docs)
+        timings["context_tokens_full"] = full_tokens
+        if full_tokens <= self.budget_tokens:
+            timings["context_tokens"] = full_tokens
+            timings["compress"] = time.perf_counter() - start
+            return docs, {}
+
+        sentences = [(i, begin, end) for i, doc in enumerate(docs) for begin, end in split_sentences(doc.page_content)]
+        texts = [docs[i].page_content[begin:end] for i, begin, end in sentences]
+        vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+        query = np.asarray(query_vector, dtype=np.float32)
+        scores = vectors @ query / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query) + 1e-12)
+
+        kept, used = [], 0
+        for n in np.argsort(-scores):
+            tokens = self.count_tokens(texts[n])
+            if kept and used + tokens > self.budget_tokens:
+                continue
+            kept.append(n)
+            used += tokens
+
+        spans: Dict[int, List[List[int]]] = {}
+        for n in sorted(kept):
+            i, begin, end = sentences[n]
+            doc_spans = spans.setdefault(i, [])
+            # Sentences that were adjacent in the chunk stay one span.
+            if doc_spans and not docs[i].page_content[doc_spans[-1][1]:begin].strip():
+                doc_spans[-1][1] = end
+            else:
+                doc_spans.append([begin, end])
+
+        compressed, spans_by_id = [], {}
+        for i, doc in enumerate(docs):
+            if i not in spans:
+                continue
+            text = SPAN_SEPARATOR.join(doc.page_content[begin:end] for begin, end in spans[i])
+            compressed.append(Document(page_content=text, metadata=doc.metadata))
+            spans_by_id[doc.metadata.get("id", "")] = spans[i]
+        timings["context_tokens"] = sum(self.count_tokens(doc.page_content) for doc in compressed)
+        timings["compress"] = time.perf_counter() - start
+        return compressed, spans_by_id
+
+    def observe_prefill(self, tokens: Optional[int], seconds: float) -> None:
+        if not tokens or seconds <= 0:
+            return
+        rate = tokens / seconds
+        if self.prefill_tokens_per_s is None:
+            self.prefill_tokens_per_s = rate
+        else:
+            self.prefill_tokens_per_s += PREFILL_SMOOTHING * (rate - self.prefill_tokens_per_s)
+
+    def estimate_gain(self, timings: Dict[str, float]) -> None:
+        # Net seconds saved: prefill time of the dropped tokens minus the time
+        # spent compressing. Negative when compression cost more than it saved.
+        saved = timings.get("context_tokens_full", 0) - timings.get("context_tokens", 0)
+        timings["context_tokens_saved"] = saved
+        if self.prefill_tokens_per_s:
+            timings["compression_gain"] = saved / self.prefill_tokens_per_s - timings.get("compress", 0.0)
@@ -0,0 +1,229 @@
+import os
+import re
+import json
+import zlib
+import sqlite3
+import threading
+import numpy as np
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple
+from utils import batched, compute_sha1
+from chunk_index import source_of
+
+if TYPE_CHECKING:
+    from langchain.docstore.document import Document
+
+LOOKUP_BATCH = 500
+COMMIT_EVERY = 256
+WORD_RE = re.compile(r"\w+")
+MERSENNE_PRIME = (1 << 61) - 1
+REFERENCE_FIELDS = ("id", "file", "page", "chunk")
+
+
+def references_of(metadata: Dict) -> List[Dict]:
+    # Canonical chunks carry their duplicates as a JSON string, since Chroma
+    # metadata values must be scalars.
+    try:
+        return json.loads(metadata.get("duplicates") or "[]")
+    except ValueError:
+        return []
+
+
+class DedupIndex:
+    # Finds chunks that repeat one already stored, exactly (same normalized
+    # words) or nearly (MinHash over word shingles, candidates found by LSH
+    # banding and kept above `threshold` estimated Jaccard similarity).
+    # Only the first copy, the canonical, is embedded and stored; the others
+    # are kept here as references and mirrored onto the canonical's
+    # `duplicates` metadata so retrieval can cite every place the text occurs.
+    def __init__(self, path: str, threshold: float = 0.9, num_perm: int = 128, bands: int = 16, shingle: int = 5):
+        if num_perm % bands:
+            raise ValueError("dedup.num_perm must be a multiple of dedup.bands")
+        self.path = path
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.shingle = shingle
+        rng = np.random.default_rng(1)
+        self.perm_a = rng.integers(1, 1 << 31, size=(num_perm, 1), dtype=np.uint64)
+        self.perm_b = rng.integers(0, 1 << 31, size=(num_perm, 1), dtype=np.uint64)
+        self.band_weights = rng.integers(1, 1 << 31, size=self.rows_per_band, dtype=np.uint64)
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS canonical (id TEXT PRIMARY KEY, exact TEXT NOT NULL, signature BLOB NOT NULL) WITHOUT ROWID"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS canonical_exact ON canonical (exact)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS bands (band INTEGER NOT NULL, hash INTEGER NOT NULL, id TEXT NOT NULL, "
+            "PRIMARY KEY (band, hash, id)) WITHOUT ROWID"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS duplicates (id TEXT PRIMARY KEY, canonical TEXT NOT NULL, "
+            "kind TEXT NOT NULL, text TEXT NOT NULL, metadata TEXT NOT NULL) WITHOUT ROWID"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS duplicates_canonical ON duplicates (canonical)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        # Signatures from other MinHash settings are not comparable; drop them
+        # and let VectorstoreManager re-register the stored chunks.
+        params = json.dumps([num_perm, bands, shingle])
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'params'").fetchone()
+        if row is not None and row[0] != params:
+            self.conn.execute("DELETE FROM canonical")
+            self.conn.execute("DELETE FROM bands")
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('params', ?)", (params,))
+        self.conn.commit()
+
+    def is_empty(self) -> bool:
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM canonical LIMIT 1").fetchone() is None
+
+    def _signature(self, words: List[str]) -> np.ndarray:
+        size = min(self.shingle, len(words)) or 1
+        shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+        return ((self.perm_a * hashes + self.perm_b) % MERSENNE_PRIME).min(axis=1).astype(np.uint32)
+
+    def _band_hashes(self, signature: np.ndarray) -> List[int]:
+        rows = signature.astype(np.uint64).reshape(self.bands, self.rows_per_band)
+        return [int(h) for h in ((rows * self.band_weights).sum(axis=1) & np.uint64((1 << 63) - 1))]
+
+    def _match(self, exact: str, signature: np.ndarray) -> Optional[Tuple[str, str]]:
+        row = self.conn.execute("SELECT id FROM canonical WHERE exact = ? LIMIT 1", (exact,)).fetchone()
+        if row is not None:
+            return row[0], "exact"
+        candidates = set()
+        for band, band_hash in enumerate(self._band_hashes(signature)):
+            candidates.update(chunk_id for (chunk_id,) in self.conn.execute(
+                "SELECT id FROM bands WHERE band = ? AND hash = ?", (band, band_hash)
+            ))
+        best, best_score = None, self.threshold
+        for batch in batched(sorted(candidates), LOOKUP_BATCH):
+            for chunk_id, blob in self.conn.execute(
+                f"SELECT id, signature FROM canonical WHERE id IN ({','.join('?' * len(batch))})", batch
+            ):
+                score = float(np.mean(np.frombuffer(blob, dtype=np.uint32) == signature))
+                if score >= best_score:
+                    best, best_score = chunk_id, score
+        return (best, "near") if best is not None else None
+
+    def _add_canonical(self, chunk_id: str, exact: str, signature: np.ndarray) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO canonical (id, exact, signature) VALUES (?, ?, ?)",
+            (chunk_id, exact, signature.tobytes())
+        )
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO bands (band, hash, id) VALUES (?, ?, ?)",
+            [(band, band_hash, chunk_id) for band, band_hash in enumerate(self._band_hashes(signature))]
+        )
+
+    def _fingerprint(self, text: str) -> Tuple[str, np.ndarray]:
+        words = WORD_RE.findall(text.lower())
+        return compute_sha1(" ".join(words)), self._signature(words)
+
+    def add(self, items: Iterable[Tuple[str, str]]) -> None:
+        # Registers chunks already in the store as canonicals.
+        with self.lock:
+            for chunk_id, text in items:
+                self._add_canonical(chunk_id, *self._fingerprint(text))
+            self.conn.commit()
+
+    def filter(self, chunks: Iterable["Document"], stats: Dict) -> Iterator["Document"]:
+        # Yields the chunks to embed and store; duplicates are recorded here
+        # instead. `stats` collects counts and the canonicals whose reference
+        # lists changed (their store metadata needs refreshing).
+        for key in ("exact", "near", "bytes"):
+            stats.setdefault(key, 0)
+        stats.setdefault("files", {})
+        stats.setdefault("chunks", [])
+        stats.setdefault("touched", set())
+        seen = 0
+        for doc in chunks:
+            chunk_id = doc.metadata["id"]
+            exact, signature = self._fingerprint(doc.page_content)
+            with self.lock:
+                match = self._match(exact, signature)
+                if match is None or match[0] == chunk_id:
+                    self._add_canonical(chunk_id, exact, signature)
+                else:
+                    canonical, kind = match
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO duplicates (id, canonical, kind, text, metadata) VALUES (?, ?, ?, ?, ?)",
+                        (chunk_id, canonical, kind, doc.page_content, json.dumps(doc.metadata))
+                    )
+                    file = source_of(doc.metadata)
+                    stats[kind] += 1
+                    stats["bytes"] += len(doc.page_content.encode("utf-8"))
+                    stats["files"][file] = stats["files"].get(file, 0) + 1
+                    stats["chunks"].append((chunk_id, file))
+                    stats["touched"].add(canonical)
+                seen += 1
+                if seen % COMMIT_EVERY == 0:
+                    self.conn.commit()
+            if match is None or match[0] == chunk_id:
+                yield doc
+        with self.lock:
+            self.conn.commit()
+
+    def references(self, canonical_ids: Iterable[str]) -> Dict[str, List[Dict]]:
+        found: Dict[str, List[Dict]] = {chunk_id: [] for chunk_id in canonical_ids}
+        with self.lock:
+            for batch in batched(list(found), LOOKUP_BATCH):
+                for canonical, metadata in self.conn.execute(
+                    f"SELECT canonical, metadata FROM duplicates WHERE canonical IN ({','.join('?' * len(batch))}) "
+                    "ORDER BY id", batch
+                ):
+                    metadata = json.loads(metadata)
+                    found[canonical].append({field: metadata.get(field) for field in REFERENCE_FIELDS})
+        return found
+
+    def remove(self, chunk_ids: Iterable[str]) -> Tuple[List[str], Dict[str, Tuple[str, Dict]], set]:
+        # Forgets `chunk_ids` and returns (ids stored in the vectorstore,
+        # promotions, touched canonicals). A removed canonical that still has
+        # duplicates hands over to its first one: promotions map the old ID
+        # to (text, metadata) of the chunk that must now be stored in its place.
+        stored, promotions, touched = [], {}, set()
+        chunk_ids = list(chunk_ids)
+        with self.lock:
+            # Duplicates go first, so a removed chunk never becomes an heir.
+            for chunk_id in chunk_ids:
+                row = self.conn.execute("SELECT canonical FROM duplicates WHERE id = ?", (chunk_id,)).fetchone()
+                if row is None:
+                    stored.append(chunk_id)
+                else:
+                    self.conn.execute("DELETE FROM duplicates WHERE id = ?", (chunk_id,))
+                    touched.add(row[0])
+            for chunk_id in stored:
+                self.conn.execute("DELETE FROM canonical WHERE id = ?", (chunk_id,))
+                self.conn.execute("DELETE FROM bands WHERE id = ?", (chunk_id,))
+                heir = self.conn.execute(
+                    "SELECT id, text, metadata FROM duplicates WHERE canonical = ? ORDER BY id LIMIT 1", (chunk_id,)
+                ).fetchone()
+                if heir is None:
+                    continue
+                heir_id, text, metadata = heir
+                self.conn.execute("DELETE FROM duplicates WHERE id = ?", (heir_id,))
+                self.conn.execute("UPDATE duplicates SET canonical = ? WHERE canonical = ?", (heir_id, chunk_id))
+                self._add_canonical(heir_id, *self._fingerprint(text))
+                promotions[chunk_id] = (text, json.loads(metadata))
+                touched.add(heir_id)
+            self.conn.commit()
+        touched -= set(stored)
+        return stored, promotions, touched
+
+    def duplicate_sources(self, data_path: str = "") -> List[Tuple[str, str]]:
+        # (chunk ID, source) of every duplicate, for rebuilding the chunk ID index.
+        with self.lock:
+            rows = list(self.conn.execute("SELECT id, metadata FROM duplicates"))
+        return [(chunk_id, source_of(json.loads(metadata), data_path)) for chunk_id, metadata in rows]
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            canonical = self.conn.execute("SELECT COUNT(*) FROM canonical").fetchone()[0]
+            duplicates = self.conn.execute("SELECT COUNT(*) FROM duplicates").fetchone()[0]
+        return {"canonical": canonical, "duplicates": duplicates}
+
+    def close(self) -> None:
+        self.conn.close()
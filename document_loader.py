@@ -1,36 +1,90 @@
 import os
 import json
+import yaml
 import requests
-from utils import compute_sha1
+import threading
+import multiprocessing
+from collections import deque
+from urllib.parse import urlparse
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from utils import compute_sha1, can_start_process_pool
 from bs4 import BeautifulSoup
-from typing import List
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from abc import ABC, abstractmethod
 from langchain.docstore.document import Document
 from langchain.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 
+def _load_file_in_worker(config: dict, path: str) -> List[Document]:
+    return SmartDocumentLoader(config=config).load_file(path)
+
+
 class BaseDocumentLoader(ABC):
+    extensions: Tuple[str, ...] = ()
+
     def __init__(self, config_path: str = "config.yaml", config: dict = None):
         self.config = config or self._load_config(config_path)
         self.chunk_size = self.config.get("chunk", {}).get("size", 800)
         self.chunk_overlap = self.config.get("chunk", {}).get("overlap", 80)
+        self.chunk_mode = self.config.get("chunk", {}).get("mode", "recursive")
+        self.chunk_min_size = self.config.get("chunk", {}).get("min_size")
 
     def _load_config(self, path):
         with open(path) as f:
             return yaml.safe_load(f)
 
+    def list_files(self) -> List[str]:
+        # Sorted so that load order, and therefore chunk order, is stable.
+        return [
+            os.path.join(self.path, file)
+            for file in sorted(os.listdir(self.path))
+            if file.endswith(self.extensions)
+        ]
+
+    def load(self, files: Optional[List[str]] = None) -> List[Document]:
+        return list(self.iter_load(files))
+
+    def iter_load(self, files: Optional[List[str]] = None) -> Iterator[Document]:
+        for _, docs in self.iter_files(self.list_files() if files is None else files):
+            yield from docs
+
+    def iter_files(self, files: List[str]) -> Iterator[Tuple[str, List[Document]]]:
+        for path in files:
+            yield path, self.tag_source(path, self.load_file(path))
+
+    @staticmethod
+    def tag_source(path: str, docs: List[Document]) -> List[Document]:
+        # `source` is what the document cites (a URL for URL lists); the file
+        # it was read from is the vectorstore sync key.
+        for doc in docs:
+            doc.metadata["source_path"] = path
+        return docs
+
     @abstractmethod
-    def load(self) -> List[Document]:
+    def load_file(self, path: str) -> List[Document]:
         pass
 
     def split_documents(self, documents: List[Document]) -> List[Document]:
-        splitter = RecursiveCharacterTextSplitter(
+        return list(self.iter_split(documents))
+
+    def iter_split(self, documents: Iterable[Document]) -> Iterator[Document]:
+        # Splits one document at a time so only its chunks are held in memory.
+        splitter = self.make_splitter()
+        for doc in documents:
+            yield from self.assign_chunk_ids(splitter.split_documents([doc]))
+
+    def make_splitter(self):
+        # chunk.mode "content" picks boundaries from the surrounding text, so
+        # an edit leaves the IDs of the chunks around it unchanged.
+        if self.chunk_mode == "content":
+            from content_splitter import ContentDefinedSplitter
+            return ContentDefinedSplitter(chunk_size=self.chunk_size, min_size=self.chunk_min_size)
+        return RecursiveCharacterTextSplitter(
             chunk_size=self.chunk_size,
             chunk_overlap=self.chunk_overlap
         )
-        chunks = splitter.split_documents(documents)
-        return self.assign_chunk_ids(chunks)
 
     @staticmethod
     def assign_chunk_ids(chunks: List[Document]) -> List[Document]:
@@ -48,66 +102,90 @@ class BaseDocumentLoader(ABC):
 
 
 class PDFLoader(BaseDocumentLoader):
+    extensions = (".pdf",)
+
     def __init__(self, path: str, **kwargs):
         super().__init__(**kwargs)
         self.path = path
 
-    def load(self) -> List[Document]:
-        docs = []
-        for file in os.listdir(self.path):
-            if file.endswith(".pdf"):
-                loader = PyPDFLoader(os.path.join(self.path, file))
-                docs.extend(loader.load())
-        return docs
+    def load_file(self, path: str) -> List[Document]:
+        return PyPDFLoader(path).load()
 
 
 class JSONLoader(BaseDocumentLoader):
+    extensions = (".json",)
+
     def __init__(self, path: str, **kwargs):
         super().__init__(**kwargs)
         self.path = path
 
-    def load(self) -> List[Document]:
+    def load_file(self, path: str) -> List[Document]:
         docs = []
-        for file in os.listdir(self.path):
-            if file.endswith(".json"):
-                with open(os.path.join(self.path, file), "r") as f:
-                    data = json.load(f)
-                    if isinstance(data, list):
-                        for entry in data:
-                            content = entry.get("text") or json.dumps(entry)
-                            docs.append(Document(page_content=content, metadata={"source": file}))
-                    elif isinstance(data, dict):
-                        content = data.get("text") or json.dumps(data)
-                        docs.append(Document(page_content=content, metadata={"source": file}))
+        file = os.path.basename(path)
+        with open(path, "r") as f:
+            data = json.load(f)
+            if isinstance(data, list):
+                for entry in data:
+                    content = entry.get("text") or json.dumps(entry)
+                    docs.append(Document(page_content=content, metadata={"source": file}))
+            elif isinstance(data, dict):
+                content = data.get("text") or json.dumps(data)
+                docs.append(Document(page_content=content, metadata={"source": file}))
         return docs
 
 
 class WebPageLoader(BaseDocumentLoader):
+    extensions = (".txt", ".html")
+
     def __init__(self, path: str, **kwargs):
         super().__init__(**kwargs)
         self.path = path
 
-    def load(self) -> List[Document]:
+    def load_file(self, path: str) -> List[Document]:
         docs = []
-        for file in os.listdir(self.path):
-            full_path = os.path.join(self.path, file)
-            if file.endswith(".txt"):  # each line is a URL
-                with open(full_path, "r") as f:
-                    for url in f.readlines():
-                        url = url.strip()
-                        try:
-                            html = requests.get(url, timeout=10).text
-                            text = self.extract_text(html)
-                            docs.append(Document(page_content=text, metadata={"source": url}))
-                        except Exception as e:
-                            print(f"⚠️ Failed to load {url}: {e}")
-            elif file.endswith(".html"):
-                with open(full_path, "r", encoding="utf-8") as f:
-                    html = f.read()
+        if path.endswith(".txt"):  # each line is a URL
+            with open(path, "r") as f:
+                urls = [line.strip() for line in f if line.strip()]
+            for url, html in zip(urls, self.fetch_urls(urls)):
+                if html is not None:
                     text = self.extract_text(html)
-                    docs.append(Document(page_content=text, metadata={"source": file}))
+                    docs.append(Document(page_content=text, metadata={"source": url}))
+        elif path.endswith(".html"):
+            with open(path, "r", encoding="utf-8") as f:
+                html = f.read()
+                text = self.extract_text(html)
+                docs.append(Document(page_content=text, metadata={"source": os.path.basename(path)}))
         return docs
 
+    def fetch_urls(self, urls: List[str]) -> List[Optional[str]]:
+        # Fetches concurrently over one pooled session, with at most
+        # `loader.per_host` requests to the same host at a time. Results keep
+        # the order of `urls`; failed fetches are None.
+        loader_config = self.config.get("loader", {})
+        url_workers = max(1, loader_config.get("url_workers", 16))
+        per_host = max(1, loader_config.get("per_host", 4))
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=url_workers, pool_maxsize=url_workers)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        host_limits: Dict[str, threading.BoundedSemaphore] = {}
+        limits_lock = threading.Lock()
+
+        def fetch(url: str) -> Optional[str]:
+            host = urlparse(url).netloc
+            with limits_lock:
+                limit = host_limits.setdefault(host, threading.BoundedSemaphore(per_host))
+            try:
+                with limit:
+                    return session.get(url, timeout=10).text
+            except Exception as e:
+                print(f"⚠️ Failed to load {url}: {e}")
+                return None
+
+        with session, ThreadPoolExecutor(max_workers=url_workers) as pool:
+            return list(pool.map(fetch, urls))
+
     def extract_text(self, html: str) -> str:
         soup = BeautifulSoup(html, "html.parser")
         return soup.get_text(separator="\n", strip=True)
@@ -117,18 +195,50 @@ class SmartDocumentLoader(BaseDocumentLoader):
     def __init__(self, config_path: str = "config.yaml", config: dict = None):
         super().__init__(config_path=config_path, config=config)
         self.path = self.config.get("data_path", "./data")
-
-    def load(self) -> List[Document]:
-        docs = []
-        file_types = os.listdir(self.path)
-        print(f"📄 Loaded {len(file_types)} documents from {self.path}")
-
-        if any(f.endswith(".pdf") for f in file_types):
-            docs.extend(PDFLoader(self.path, config=self.config).load())
-        if any(f.endswith(".json") for f in file_types):
-            docs.extend(JSONLoader(self.path, config=self.config).load())
-        if any(f.endswith((".txt", ".html")) for f in file_types):
-            docs.extend(WebPageLoader(self.path, config=self.config).load())
-
-        return docs
-
+        self.loaders = [
+            PDFLoader(self.path, config=self.config),
+            JSONLoader(self.path, config=self.config),
+            WebPageLoader(self.path, config=self.config),
+        ]
+        self.extensions = tuple(ext for loader in self.loaders for ext in loader.extensions)
+
+    def iter_load(self, files: Optional[List[str]] = None) -> Iterator[Document]:
+        files = self.list_files() if files is None else files
+        print(f"📄 Loaded {len(files)} documents from {self.path}")
+        return super().iter_load(files)
+
+    def load_file(self, path: str) -> List[Document]:
+        for loader in self.loaders:
+            if path.endswith(loader.extensions):
+                return loader.load_file(path)
+        return []
+
+    def iter_files(self, files: List[str]) -> Iterator[Tuple[str, List[Document]]]:
+        # Parses PDF, JSON and HTML files in a process pool and URL lists on a
+        # thread (their fetches are I/O bound). Results are yielded in the
+        # order of `files` so chunk order stays deterministic, with at most
+        # two files per worker held in memory ahead of the consumer. Workers
+        # are spawned rather than forked from a process running other threads.
+        workers = self.config.get("loader", {}).get("workers", os.cpu_count() or 1)
+        if workers <= 1 or len(files) <= 1 or not can_start_process_pool():
+            for path in files:
+                yield path, self.tag_source(path, self.load_file(path))
+            return
+
+        worker_config = {"data_path": self.path, "chunk": self.config.get("chunk", {})}
+        pending: deque = deque()
+        spawn = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=spawn) as processes, \
+                ThreadPoolExecutor(max_workers=workers) as threads:
+            for path in files:
+                if path.endswith(".txt"):
+                    future: Future = threads.submit(self.load_file, path)
+                else:
+                    future = processes.submit(_load_file_in_worker, worker_config, path)
+                pending.append((path, future))
+                if len(pending) >= workers * 2:
+                    path_done, future_done = pending.popleft()
+                    yield path_done, self.tag_source(path_done, future_done.result())
+            while pending:
+                path_done, future_done = pending.popleft()
+                yield path_done, self.tag_source(path_done, future_done.result())
@@ -0,0 +1,149 @@
+import os
+import time
+import sqlite3
+import threading
+from array import array
+from typing import Dict, List, Optional
+from langchain_core.embeddings import Embeddings
+from utils import compute_sha1, batched
+
+LOOKUP_BATCH = 500
+
+
+class EmbeddingCache:
+    def __init__(self, path: str, max_entries: int = 500_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, key TEXT NOT NULL, vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL, PRIMARY KEY (model, key))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings (last_used)")
+        self.conn.commit()
+        self.size = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        keys = [compute_sha1(text) for text in texts]
+        found: Dict[str, List[float]] = {}
+        with self.lock:
+            for batch in batched(sorted(set(keys)), LOOKUP_BATCH):
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE model = ? AND key IN ({','.join('?' * len(batch))})",
+                    [model, *batch]
+                )
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+
+            if found:
+                now = time.time()
+                self.conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND key = ?",
+                    [(now, model, key) for key in found]
+                )
+                self.conn.commit()
+
+        results = [found.get(key) for key in keys]
+        hits = sum(vector is not None for vector in results)
+        self.hits += hits
+        self.misses += len(results) - hits
+        return results
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]) -> None:
+        now = time.time()
+        rows = [
+            (model, compute_sha1(text), array("f", vector).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        with self.lock:
+            inserted = self.conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, key, vector, last_used) VALUES (?, ?, ?, ?)", rows
+            ).rowcount
+            self.size += max(inserted, 0)
+            if self.size > self.max_entries:
+                self._evict()
+            self.conn.commit()
+
+    def _evict(self) -> None:
+        # Trim to 90% of the limit so eviction doesn't run on every insert.
+        excess = self.size - int(self.max_entries * 0.9)
+        self.conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN "
+            "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+        )
+        self.size -= excess
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": self.size,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, model_name: str):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.cache.get_many(self.model_name, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            # Embed each distinct missing text once, even if it repeats.
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            computed = dict(zip(unique_texts, self.embeddings.embed_documents(unique_texts)))
+            self.cache.put_many(self.model_name, unique_texts, [computed[text] for text in unique_texts])
+            for i in missing:
+                vectors[i] = computed[texts[i]]
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+
+class LazyEmbeddings(Embeddings):
+    # Defers importing sentence-transformers and loading the model until the
+    # first embed call, or loads it on a background thread via load_async().
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.model = None
+        self.lock = threading.Lock()
+        self.load_started = None
+        self.load_finished = None
+
+    def load(self) -> Embeddings:
+        with self.lock:
+            if self.model is None:
+                self.load_started = time.perf_counter()
+                from langchain.embeddings import HuggingFaceEmbeddings
+                self.model = HuggingFaceEmbeddings(model_name=self.model_name)
+                self.load_finished = time.perf_counter()
+        return self.model
+
+    def load_async(self) -> None:
+        # Failures are ignored here; the next load() retries and raises.
+        def load_quietly():
+            try:
+                self.load()
+            except Exception:
+                pass
+        threading.Thread(target=load_quietly, daemon=True).start()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.load().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.load().embed_query(text)
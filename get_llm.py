@@ -1,6 +1,187 @@
 import os
+import math
+from typing import Any, Dict, Iterator, List, Optional
 from langchain_community.llms import LlamaCpp
 
+
+def _common_prefix(a: List[int], b: List[int]) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class CachedLlamaCpp(LlamaCpp):
+    # llama.cpp skips re-evaluating the longest prefix shared with the tokens
+    # already in its KV cache, and with a LlamaRAMCache attached it can also
+    # restore saved states from earlier calls. This subclass records how much
+    # of each prompt was reused versus evaluated.
+    prompt_stats: Dict[str, int] = {}
+
+    def _track_prompt(self, prompt: str) -> None:
+        self.prompt_stats = {}
+        try:
+            tokens = self.client.tokenize(prompt.encode("utf-8"))
+            reused = _common_prefix(self.client._input_ids.tolist(), tokens)
+            if self.client.cache is not None:
+                try:
+                    state = self.client.cache[tokens]
+                    reused = max(reused, _common_prefix(state.input_ids.tolist(), tokens))
+                except KeyError:
+                    pass
+        except Exception:
+            return
+        self.prompt_stats = {
+            "prompt_tokens": len(tokens),
+            "reused_tokens": reused,
+            "evaluated_tokens": len(tokens) - reused,
+        }
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+        # With streaming enabled LlamaCpp._call delegates to _stream.
+        if not self.streaming:
+            self._track_prompt(prompt)
+        return super()._call(prompt, stop=stop, run_manager=run_manager, **kwargs)
+
+    def _stream(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> Iterator:
+        self._track_prompt(prompt)
+        return super()._stream(prompt, stop=stop, run_manager=run_manager, **kwargs)
+
+
+def _attach_prompt_cache(llm: CachedLlamaCpp, llm_config: dict) -> CachedLlamaCpp:
+    cache_mb = llm_config.get("prompt_cache_mb", 512)
+    if cache_mb:
+        from llama_cpp import LlamaRAMCache
+        llm.client.set_cache(LlamaRAMCache(capacity_bytes=cache_mb << 20))
+    return llm
+
+
+def _physical_cores() -> Optional[int]:
+    # Distinct (physical id, core id) pairs; hyperthreads don't speed up
+    # llama.cpp matmuls, so threads beyond physical cores mostly add contention.
+    try:
+        cores, physical_id = set(), None
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                key = key.strip()
+                if key == "physical id":
+                    physical_id = value.strip()
+                elif key == "core id":
+                    cores.add((physical_id, value.strip()))
+        return len(cores) or None
+    except OSError:
+        return None
+
+
+def _meminfo() -> Dict[str, int]:
+    info = {}
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                info[key] = int(value.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    total = info.get("MemTotal")
+    if total is None and hasattr(os, "sysconf"):
+        try:
+            total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+        except (ValueError, OSError):
+            total = None
+    return {"total": total, "available": info.get("MemAvailable", total)}
+
+
+def _memlock_limit() -> Optional[float]:
+    # Soft RLIMIT_MEMLOCK in bytes (inf when unlimited). Past it mlock fails
+    # and llama.cpp only warns, so locking is pointless; None off POSIX.
+    try:
+        import resource
+    except ImportError:
+        return None
+    soft, _ = resource.getrlimit(resource.RLIMIT_MEMLOCK)
+    return math.inf if soft == resource.RLIM_INFINITY else soft
+
+
+def detect_hardware() -> Dict[str, Any]:
+    logical = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    physical = min(_physical_cores() or logical, logical)
+    try:
+        import llama_cpp
+        gpu_offload = bool(llama_cpp.llama_supports_gpu_offload())
+        mlock_supported = bool(llama_cpp.llama_supports_mlock())
+    except (ImportError, AttributeError):
+        gpu_offload, mlock_supported = False, False
+    memory = _meminfo()
+    return {
+        "logical_cores": logical,
+        "physical_cores": physical,
+        "memory_total": memory["total"],
+        "memory_available": memory["available"],
+        "gpu_offload": gpu_offload,
+        "mlock_supported": mlock_supported,
+        "memlock_limit": _memlock_limit(),
+    }
+
+
+def plan_llm_load(config: dict, model_path: str, overrides: dict = {}) -> Dict[str, Any]:
+    # Each of n_threads, n_batch, n_gpu_layers and use_mlock may be set in
+    # config.yaml; "auto" (the default) picks a value for this machine.
+    llm_config = config.get("llm", {})
+    hardware = detect_hardware()
+    model_size = os.path.getsize(model_path)
+    n_ctx = llm_config.get("n_ctx", 2048)
+
+    def setting(key):
+        value = overrides.get(key)
+        if value is None:
+            value = llm_config.get(key, "auto")
+        return None if value == "auto" else value
+
+    n_gpu_layers = setting("n_gpu_layers")
+    if n_gpu_layers is None:
+        n_gpu_layers = -1 if hardware["gpu_offload"] else 0
+
+    n_threads = setting("n_threads") or hardware["physical_cores"]
+    n_batch = setting("n_batch") or min(512, n_ctx)
+
+    # Lock the model in RAM only when the memlock limit allows it and it fits
+    # comfortably; otherwise rely on the page cache behind mmap.
+    use_mlock = setting("use_mlock")
+    if use_mlock is None:
+        available = hardware["memory_available"]
+        limit = hardware["memlock_limit"]
+        use_mlock = bool(
+            hardware["mlock_supported"] and limit is not None and model_size <= limit
+            and available and model_size * 2 < available
+        )
+
+    return {
+        "n_gpu_layers": n_gpu_layers,
+        "n_threads": n_threads,
+        "n_batch": n_batch,
+        "use_mmap": llm_config.get("use_mmap", True),
+        "use_mlock": use_mlock,
+        "model_size": model_size,
+        "hardware": hardware,
+    }
+
+
+def describe_plan(plan: Dict[str, Any]) -> str:
+    hardware = plan["hardware"]
+    memory = hardware["memory_available"]
+    return (
+        f"{'GPU offload' if plan['n_gpu_layers'] else 'CPU only'}, "
+        f"{plan['n_threads']} threads ({hardware['physical_cores']} physical / {hardware['logical_cores']} logical cores), "
+        f"n_batch {plan['n_batch']}, mmap {'on' if plan['use_mmap'] else 'off'}, "
+        f"mlock {'on' if plan['use_mlock'] else 'off'}, "
+        f"model {plan['model_size'] / 2**30:.1f} GiB"
+        + (f", {memory / 2**30:.1f} GiB RAM available" if memory else "")
+    )
+
+
 def get_local_llm(config: dict, overrides: dict = {}):
     llm_config = config.get("llm", {})
     model_path = overrides.get("model_path") or llm_config.get("local_model_path")
@@ -8,28 +189,34 @@ def get_local_llm(config: dict, overrides: dict = {}):
     if model_path is None or not os.path.exists(model_path):
         raise ValueError(f"❌ LLM model path is invalid or missing: {model_path}")
 
-    try:
-        return LlamaCpp(
-            model_path=model_path,
-            temperature=overrides.get("temperature", llm_config.get("temperature", 0.7)),
-            max_tokens=llm_config.get("max_tokens", 512),
-            top_p=llm_config.get("top_p", 0.95),
-            n_ctx=llm_config.get("n_ctx", 2048),
-            n_threads=llm_config.get("n_threads", 4),
-            n_gpu_layers=-1,  # Try GPU
-            verbose=False,
-        )
-    except Exception as e:
-        print(f"⚠️ GPU loading failed: {e}. Falling back to CPU...")
+    plan = plan_llm_load(config, model_path, overrides)
+    print(f"🧮 LLM load plan: {describe_plan(plan)}")
+
+    temperature = overrides.get("temperature")
+    if temperature is None:
+        temperature = llm_config.get("temperature", 0.7)
 
-        return LlamaCpp(
+    def build(n_gpu_layers):
+        return CachedLlamaCpp(
             model_path=model_path,
-            temperature=overrides.get("temperature", llm_config.get("temperature", 0.7)),
+            temperature=temperature,
             max_tokens=llm_config.get("max_tokens", 512),
             top_p=llm_config.get("top_p", 0.95),
             n_ctx=llm_config.get("n_ctx", 2048),
-            n_threads=llm_config.get("n_threads", 4),
-            n_gpu_layers=0,  # CPU mode
+            n_threads=plan["n_threads"],
+            n_batch=plan["n_batch"],
+            use_mmap=plan["use_mmap"],
+            use_mlock=plan["use_mlock"],
+            n_gpu_layers=n_gpu_layers,
             verbose=False,
         )
 
+    if not plan["n_gpu_layers"]:
+        return _attach_prompt_cache(build(0), llm_config)
+    try:
+        llm = build(plan["n_gpu_layers"])
+    except Exception as e:
+        # Only reached on GPU-capable builds, e.g. when VRAM is exhausted.
+        print(f"⚠️ GPU loading failed: {e}. Falling back to CPU...")
+        llm = build(0)
+    return _attach_prompt_cache(llm, llm_config)
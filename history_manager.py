@@ -0,0 +1,78 @@
+from typing import Dict, List, Tuple
+from langchain_core.documents import Document
+from langchain_core.messages import BaseMessage
+
+# Tokens held back for role prefixes and template text around the prompt parts.
+TEMPLATE_OVERHEAD = 32
+
+
+class HistoryWindow:
+    # Picks the most recent chat turns that fit in the context window next to
+    # the system prompt, retrieved context and question, leaving room for the
+    # answer. Older turns are dropped from the prompt, not from memory.
+    #
+    # The first kept turn only moves when the history no longer fits, and
+    # then far enough to free half the budget, so the system prompt plus
+    # history stays a stable prefix that llama.cpp can reuse across turns.
+    def __init__(self, llm, config: dict, system_prompt: str):
+        llm_config = config.get("llm", {})
+        history_config = config.get("history", {})
+        self.llm = llm
+        self.n_ctx = getattr(llm, "n_ctx", None) or llm_config.get("n_ctx", 2048)
+        self.max_tokens = getattr(llm, "max_tokens", None) or llm_config.get("max_tokens", 512)
+        self.reserve = history_config.get("reserve_tokens", TEMPLATE_OVERHEAD)
+        self.token_counts: Dict[str, int] = {}
+        self.system_tokens = self.count(system_prompt)
+        self.start = 0
+
+    def count(self, text: str) -> int:
+        if text in self.token_counts:
+            return self.token_counts[text]
+        try:
+            tokens = self.llm.get_num_tokens(text)
+        except Exception:
+            tokens = len(text) // 4 + 1
+        if len(self.token_counts) > 4096:
+            self.token_counts.clear()
+        self.token_counts[text] = tokens
+        return tokens
+
+    def select(
+        self, messages: List[BaseMessage], question: str, docs: List[Document]
+    ) -> Tuple[List[BaseMessage], Dict[str, int]]:
+        fixed = (
+            self.system_tokens
+            + self.count(question)
+            + sum(self.count(doc.page_content) for doc in docs)
+        )
+        budget = self.n_ctx - self.max_tokens - self.reserve - fixed
+
+        if self.start > len(messages):
+            self.start = 0
+        turn_tokens = self._turn_tokens(messages)
+        if sum(turn_tokens[self.start // 2:]) > budget:
+            self.start = self._fit(messages, turn_tokens, budget // 2)
+        start = self.start
+        used = sum(turn_tokens[start // 2:])
+
+        stats = {
+            "prompt_tokens": fixed + used,
+            "history_tokens": used,
+            "history_turns": (len(messages) - start) // 2,
+            "dropped_turns": (start + 1) // 2,
+        }
+        return messages[start:], stats
+
+    def _turn_tokens(self, messages: List[BaseMessage]) -> List[int]:
+        return [
+            sum(self.count(str(m.content)) for m in messages[i:i + 2])
+            for i in range(0, len(messages), 2)
+        ]
+
+    def _fit(self, messages: List[BaseMessage], turn_tokens: List[int], budget: int) -> int:
+        # Smallest turn-aligned start index whose turns fit in `budget`.
+        turn, used = len(turn_tokens), 0
+        while turn > 0 and used + turn_tokens[turn - 1] <= budget:
+            turn -= 1
+            used += turn_tokens[turn]
+        return min(turn * 2, len(messages))
@@ -0,0 +1,37 @@
+from collections import Counter
+from typing import Any, Dict, List
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+
+
+class HybridRetriever(BaseRetriever):
+    # Dense Chroma search (search_kwargs["k"] candidates) fused with BM25 over
+    # the same chunks by reciprocal rank fusion, returning the top `k`.
+    # ChatAgent embeds the query itself and calls fuse() on the dense hits.
+    vectorstore: Any
+    index: Any
+    k: int = 3
+    rrf_k: int = 60
+    search_kwargs: Dict[str, Any] = {"k": 20}
+
+    def fuse(self, query: str, dense_docs: List[Document]) -> List[Document]:
+        lexical = self.index.search(query, self.search_kwargs["k"])
+        docs = {doc.metadata.get("id"): doc for doc in dense_docs}
+        scores = Counter()
+        for rank, chunk_id in enumerate(docs):
+            scores[chunk_id] += 1 / (self.rrf_k + rank + 1)
+        for rank, (chunk_id, _) in enumerate(lexical):
+            scores[chunk_id] += 1 / (self.rrf_k + rank + 1)
+        top = [chunk_id for chunk_id, _ in scores.most_common(self.k)]
+
+        # Lexical-only hits still need their text and metadata from Chroma.
+        missing = [chunk_id for chunk_id in top if chunk_id not in docs]
+        if missing:
+            found = self.vectorstore.get(ids=missing, include=["documents", "metadatas"])
+            for chunk_id, text, metadata in zip(found["ids"], found["documents"], found["metadatas"]):
+                docs[chunk_id] = Document(page_content=text, metadata=metadata or {})
+        return [docs[chunk_id] for chunk_id in top if chunk_id in docs]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.fuse(query, self.vectorstore.similarity_search(query, **self.search_kwargs))
@@ -0,0 +1,89 @@
+import os
+import json
+from typing import TYPE_CHECKING, Dict, Iterator, List, Set, Tuple
+from utils import compute_file_sha1
+
+if TYPE_CHECKING:
+    from langchain.docstore.document import Document
+
+
+class IngestManifest:
+    def __init__(self, config: dict):
+        self.chroma_path = config.get("vector_db_path", "./vector_db")
+        self.manifest_path = os.path.join(self.chroma_path, "ingest_manifest.json")
+        self.chunk_mode = config.get("chunk", {}).get("mode", "recursive")
+        self.entries = self._load()
+        self.pending: Dict[str, Dict] = {}
+        self.affected_files: Set[str] = set()
+        self.dirty = False
+
+    def _load(self) -> Dict[str, Dict]:
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, "r") as f:
+                    return json.load(f)
+            except Exception:
+                print("⚠️ Ingestion manifest is unreadable. Rescanning all documents.")
+        return {}
+
+    def scan(self, paths: List[str]) -> Tuple[List[str], List[str]]:
+        # Returns (changed, removed). Size and mtime are checked first; the
+        # content hash is only computed when they differ from the manifest.
+        # Files chunked under another chunk.mode are re-split.
+        changed = []
+        for path in paths:
+            stat = os.stat(path)
+            entry = self.entries.get(path)
+            if entry and entry.get("chunk_mode", "recursive") != self.chunk_mode:
+                entry = None
+            if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                continue
+
+            sha1 = compute_file_sha1(path)
+            if entry and entry["sha1"] == sha1:
+                entry["size"], entry["mtime"] = stat.st_size, stat.st_mtime
+                self.dirty = True
+                continue
+
+            self.pending[path] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha1": sha1, "chunk_mode": self.chunk_mode}
+            changed.append(path)
+
+        removed = sorted(set(self.entries) - set(paths))
+        return changed, removed
+
+    def record(self, path: str, chunks: List["Document"]) -> None:
+        entry = self.pending.pop(path, None)
+        if entry is None:
+            stat = os.stat(path)
+            entry = {"size": stat.st_size, "mtime": stat.st_mtime, "sha1": compute_file_sha1(path), "chunk_mode": self.chunk_mode}
+        entry["chunks"] = [doc.metadata["id"] for doc in chunks]
+        self.entries[path] = entry
+        self.affected_files.add(path)
+        self.dirty = True
+
+    def forget(self, path: str) -> None:
+        # Manifest paths are the vectorstore sync keys (see chunk_index.source_of).
+        if self.entries.pop(path, None) is not None:
+            self.affected_files.add(path)
+            self.dirty = True
+
+    def clear(self) -> None:
+        self.affected_files.update(self.entries)
+        self.entries = {}
+        self.dirty = True
+
+    def chunk_sources(self) -> Iterator[Tuple[str, str]]:
+        # (chunk ID, manifest path) of every recorded chunk.
+        for path, entry in self.entries.items():
+            for chunk_id in entry.get("chunks", []):
+                yield chunk_id, path
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        os.makedirs(self.chroma_path, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.manifest_path)
+        self.dirty = False
@@ -0,0 +1,417 @@
+import os
+import json
+import sqlite3
+import threading
+import numpy as np
+from typing import Any, Dict, Iterable, List, Optional
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from utils import batched
+
+LOOKUP_BATCH = 500
+# IVF lists are trained once this many vectors are stored, and retrained
+# whenever the store has grown by RETRAIN_GROWTH since the last training.
+TRAIN_MIN = 4096
+RETRAIN_GROWTH = 4
+KMEANS_ITERS = 10
+KMEANS_SAMPLES_PER_LIST = 64
+SCAN_BLOCK = 65536
+COMPACT_DEAD_RATIO = 0.25
+ARRAY_FILES = ("vectors.f32", "codes.i8", "scales.f32", "norms.f32", "lists.i32", "centroids.f32")
+# Files holding one entry per row, with the entry size in bytes per dimension
+# (scaled by dim) or fixed.
+ROW_FILES = {"vectors.f32": (4, 0), "codes.i8": (1, 0), "scales.f32": (0, 4), "norms.f32": (0, 4), "lists.i32": (0, 4)}
+
+
+class LocalANNStore(VectorStore):
+    # On-disk IVF index with int8 vectors and an exact float32 re-rank.
+    #
+    # Each vector is stored twice in append-only memory-mapped files: as int8
+    # codes with a per-vector scale (scanned on every query) and as float32
+    # (read only for the `rerank` best approximate candidates). A query
+    # probes the `nprobe` nearest IVF lists, ranks their members by
+    # approximate L2 distance from the int8 codes, then re-ranks the top
+    # candidates exactly. Ranking matches Chroma's default squared-L2 space.
+    # IDs, text and metadata live in SQLite next to the arrays; deletes are
+    # tombstones until enough rows are dead to compact.
+    def __init__(self, path: str, embedding_function: Embeddings, nprobe: int = 16, rerank: int = 64):
+        self.path = path
+        self._embedding_function = embedding_function
+        self.nprobe = nprobe
+        self.rerank = rerank
+        self.lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(path, "rows.sqlite3"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS rows (row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, "
+            "document TEXT, metadata TEXT, live INTEGER NOT NULL DEFAULT 1)"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.commit()
+        meta = dict(self.conn.execute("SELECT key, value FROM meta"))
+        self._finish_swap(json.loads(meta.get("pending_swap", "[]")))
+        self.dim = int(meta["dim"]) if "dim" in meta else None
+        self.trained_rows = int(meta.get("trained_rows", 0))
+        if self.dim is not None:
+            self._truncate_rows(int(meta["rows"]) if "rows" in meta else None)
+
+        self._open_arrays()
+        self.lists = np.array(self._array("lists.i32", np.int32))
+        self.live = np.zeros(len(self.scales), dtype=bool)
+        self.live[[row for (row,) in self.conn.execute("SELECT row FROM rows WHERE live = 1")]] = True
+        self._inverted = None
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding_function
+
+    # --- storage ---------------------------------------------------------
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _array(self, name: str, dtype, width: Optional[int] = None) -> np.ndarray:
+        path = self._file(name)
+        row_bytes = np.dtype(dtype).itemsize * (width or 1)
+        rows = os.path.getsize(path) // row_bytes if os.path.exists(path) else 0
+        shape = (rows, width) if width else (rows,)
+        if rows == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+    def _open_arrays(self) -> None:
+        dim = self.dim or 0
+        self.vectors = self._array("vectors.f32", np.float32, dim)
+        self.codes = self._array("codes.i8", np.int8, dim)
+        self.scales = self._array("scales.f32", np.float32)
+        self.norms = self._array("norms.f32", np.float32)
+        centroids = self._array("centroids.f32", np.float32, dim)
+        self.centroids = np.array(centroids) if len(centroids) else None
+
+    def _append(self, name: str, values: np.ndarray) -> None:
+        with open(self._file(name), "ab") as f:
+            f.write(np.ascontiguousarray(values).tobytes())
+
+    def _stage(self, name: str, values: Iterable[np.ndarray]) -> None:
+        with open(self._file(name + ".tmp"), "wb") as f:
+            for block in values:
+                f.write(np.ascontiguousarray(block).tobytes())
+
+    def _replace(self, name: str, values: Iterable[np.ndarray]) -> None:
+        self._stage(name, values)
+        os.replace(self._file(name + ".tmp"), self._file(name))
+
+    def _truncate_rows(self, rows: Optional[int]) -> None:
+        # upsert() appends to each row file in turn and records the row count
+        # in `meta` with the SQLite rows. Appends a crash left uncommitted are
+        # cut off so every file holds the same rows; stores from before the
+        # count was recorded keep the rows SQLite committed.
+        sizes = {name: self.dim * per_dim + fixed for name, (per_dim, fixed) in ROW_FILES.items()}
+        lengths = {
+            name: os.path.getsize(self._file(name)) // size if os.path.exists(self._file(name)) else 0
+            for name, size in sizes.items()
+        }
+        if rows is None:
+            last = self.conn.execute("SELECT MAX(row) FROM rows").fetchone()[0]
+            rows = min(min(lengths.values()), 0 if last is None else last + 1)
+        for name, length in lengths.items():
+            if length > rows:
+                with open(self._file(name), "r+b") as f:
+                    f.truncate(rows * sizes[name])
+
+    def _finish_swap(self, names: List[str]) -> None:
+        # Arrays staged by compact() are swapped in only after the matching
+        # SQLite renumbering commits, together with the `pending_swap` list.
+        # A crash before that commit leaves the old arrays and rows (stale
+        # .tmp files are dropped); after it, opening the store finishes the swap.
+        for name in ARRAY_FILES:
+            tmp_path = self._file(name + ".tmp")
+            if name in names and os.path.exists(tmp_path):
+                os.replace(tmp_path, self._file(name))
+            elif os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        if names:
+            self.conn.execute("DELETE FROM meta WHERE key = 'pending_swap'")
+            self.conn.commit()
+
+    def _set_meta(self, key: str, value) -> None:
+        self.conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (key, str(value))
+        )
+
+    def count(self) -> int:
+        return int(self.live.sum())
+
+    def upsert(self, ids: List[str], embeddings, metadatas: List[Dict], documents: List[str]) -> None:
+        # An ID already stored keeps its vector (chunk IDs hash their content)
+        # and only has its text and metadata refreshed.
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        with self.lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._set_meta("dim", self.dim)
+                self._open_arrays()
+            existing = {}
+            for batch in batched(ids, LOOKUP_BATCH):
+                existing.update((chunk_id, (row, live)) for chunk_id, row, live in self.conn.execute(
+                    f"SELECT id, row, live FROM rows WHERE id IN ({','.join('?' * len(batch))})", batch
+                ))
+
+            new = []
+            for i, chunk_id in enumerate(ids):
+                row, live = existing.get(chunk_id, (None, 0))
+                if live:
+                    self.conn.execute(
+                        "UPDATE rows SET document = ?, metadata = ? WHERE row = ?",
+                        (documents[i], json.dumps(metadatas[i]), row)
+                    )
+                    continue
+                if row is not None:
+                    self.conn.execute("DELETE FROM rows WHERE row = ?", (row,))
+                new.append(i)
+
+            if new:
+                start = len(self.scales)
+                added = vectors[new]
+                scales = np.maximum(np.abs(added).max(axis=1), 1e-12) / 127
+                codes = np.round(added / scales[:, None]).astype(np.int8)
+                lists = self._nearest(added, self.centroids) if self.centroids is not None else np.full(len(new), -1, np.int32)
+                self._append("vectors.f32", added)
+                self._append("codes.i8", codes)
+                self._append("scales.f32", scales.astype(np.float32))
+                self._append("norms.f32", (added * added).sum(axis=1).astype(np.float32))
+                self._append("lists.i32", lists)
+                self.conn.executemany(
+                    "INSERT INTO rows (row, id, document, metadata, live) VALUES (?, ?, ?, ?, 1)",
+                    [(start + j, ids[i], documents[i], json.dumps(metadatas[i])) for j, i in enumerate(new)]
+                )
+                self._set_meta("rows", start + len(new))
+                self.lists = np.concatenate([self.lists, lists])
+                self.live = np.concatenate([self.live, np.ones(len(new), dtype=bool)])
+                self._open_arrays()
+                self._inverted = None
+            self.conn.commit()
+
+            total = len(self.scales)
+            if (self.centroids is None and self.count() >= TRAIN_MIN) or (
+                self.centroids is not None and total >= RETRAIN_GROWTH * self.trained_rows
+            ):
+                self.train()
+
+    def update_metadata(self, ids: List[str], metadatas: List[Dict]) -> None:
+        # Merges the given keys into each stored row's metadata.
+        with self.lock:
+            for chunk_id, changes in zip(ids, metadatas):
+                row = self.conn.execute("SELECT row, metadata FROM rows WHERE live = 1 AND id = ?", (chunk_id,)).fetchone()
+                if row is None:
+                    continue
+                metadata = json.loads(row[1]) if row[1] else {}
+                metadata.update(changes)
+                self.conn.execute("UPDATE rows SET metadata = ? WHERE row = ?", (json.dumps(metadata), row[0]))
+            self.conn.commit()
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> None:
+        if not ids:
+            return
+        with self.lock:
+            rows = []
+            for batch in batched(ids, LOOKUP_BATCH):
+                rows.extend(row for (row,) in self.conn.execute(
+                    f"SELECT row FROM rows WHERE live = 1 AND id IN ({','.join('?' * len(batch))})", batch
+                ))
+            self.conn.executemany("UPDATE rows SET live = 0 WHERE row = ?", [(row,) for row in rows])
+            self.conn.commit()
+            self.live[rows] = False
+            if len(self.live) and 1 - self.count() / len(self.live) > COMPACT_DEAD_RATIO:
+                self.compact()
+
+    def compact(self) -> None:
+        # Rewrites the arrays without tombstoned rows and renumbers the rest.
+        with self.lock:
+            keep = np.flatnonzero(self.live)
+
+            def blocks(array):
+                for start in range(0, len(keep), SCAN_BLOCK):
+                    yield np.asarray(array[keep[start:start + SCAN_BLOCK]])
+
+            compacted = {"vectors.f32": self.vectors, "codes.i8": self.codes, "scales.f32": self.scales,
+                         "norms.f32": self.norms, "lists.i32": self.lists}
+            for name, array in compacted.items():
+                self._stage(name, blocks(array))
+            # Ascending renumbering never collides: row i is either free or
+            # the row being moved.
+            self.conn.execute("DELETE FROM rows WHERE live = 0")
+            self.conn.executemany(
+                "UPDATE rows SET row = ? WHERE row = ?", [(new, int(old)) for new, old in enumerate(keep)]
+            )
+            self._set_meta("rows", len(keep))
+            self._set_meta("pending_swap", json.dumps(list(compacted)))
+            self.conn.commit()
+            self._finish_swap(list(compacted))
+            self.lists = self.lists[keep]
+            self.live = np.ones(len(keep), dtype=bool)
+            self._open_arrays()
+            self._inverted = None
+
+    # --- IVF -------------------------------------------------------------
+
+    @staticmethod
+    def _nearest(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        distances = (centroids * centroids).sum(axis=1)[None, :] - 2 * x @ centroids.T
+        return distances.argmin(axis=1).astype(np.int32)
+
+    def train(self) -> None:
+        # k-means on a sample of live vectors, then every row is reassigned.
+        with self.lock:
+            live_rows = np.flatnonzero(self.live)
+            nlist = max(1, int(np.sqrt(len(live_rows))))
+            rng = np.random.default_rng(0)
+            sample = np.sort(rng.choice(live_rows, min(len(live_rows), nlist * KMEANS_SAMPLES_PER_LIST), replace=False))
+            x = np.asarray(self.vectors[sample])
+            centroids = x[rng.choice(len(x), nlist, replace=False)].copy()
+            for _ in range(KMEANS_ITERS):
+                assign = self._nearest(x, centroids)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assign, x)
+                counts = np.bincount(assign, minlength=nlist)
+                filled = counts > 0
+                centroids[filled] = sums[filled] / counts[filled, None]
+
+            self._replace("centroids.f32", [centroids])
+            self.lists = np.concatenate([
+                self._nearest(np.asarray(self.vectors[start:start + SCAN_BLOCK]), centroids)
+                for start in range(0, len(self.scales), SCAN_BLOCK)
+            ]) if len(self.scales) else np.zeros(0, np.int32)
+            self._replace("lists.i32", [self.lists])
+            self.trained_rows = len(self.scales)
+            self._set_meta("trained_rows", self.trained_rows)
+            self.conn.commit()
+            self._open_arrays()
+            self._inverted = None
+            print(f"🧭 Trained {nlist} IVF lists over {len(live_rows)} vectors.")
+
+    def _inverted_lists(self):
+        # Row numbers grouped by IVF list; untrained rows (-1) come first.
+        if self._inverted is None:
+            order = np.argsort(self.lists, kind="stable")
+            bounds = np.searchsorted(self.lists[order], np.arange(-1, len(self.centroids) + 1))
+            self._inverted = [order[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)]
+        return self._inverted
+
+    # --- search ----------------------------------------------------------
+
+    def _search_rows(self, query: np.ndarray, candidates: int) -> np.ndarray:
+        with self.lock:
+            vectors, codes, scales, norms, live = self.vectors, self.codes, self.scales, self.norms, self.live
+            centroids = self.centroids
+            inverted = self._inverted_lists() if centroids is not None else None
+        if centroids is not None:
+            probe = np.argsort(((centroids - query) ** 2).sum(axis=1))[:self.nprobe]
+            rows = np.concatenate([inverted[0]] + [inverted[c + 1] for c in probe])
+        else:
+            rows = np.arange(len(live))
+        rows = rows[live[rows]]
+        if not len(rows):
+            return rows
+
+        approx = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), SCAN_BLOCK):
+            block = rows[start:start + SCAN_BLOCK]
+            dots = (np.asarray(codes[block], dtype=np.float32) @ query) * scales[block]
+            approx[start:start + SCAN_BLOCK] = norms[block] - 2 * dots
+        if len(rows) > candidates:
+            rows = rows[np.argpartition(approx, candidates - 1)[:candidates]]
+        rows = np.sort(rows)
+        exact = ((np.asarray(vectors[rows]) - query) ** 2).sum(axis=1)
+        return rows[np.argsort(exact)]
+
+    def _fetch(self, rows: List[int]) -> Dict[int, tuple]:
+        found = {}
+        with self.lock:
+            for batch in batched(rows, LOOKUP_BATCH):
+                for row, chunk_id, document, metadata in self.conn.execute(
+                    f"SELECT row, id, document, metadata FROM rows WHERE row IN ({','.join('?' * len(batch))})", batch
+                ):
+                    found[row] = (chunk_id, document, json.loads(metadata) if metadata else {})
+        return found
+
+    def search_batch(self, embeddings, k: int = 4, filter: Optional[Dict] = None) -> List[List[Document]]:
+        # `filter` is an equality match on metadata, applied to the re-ranked
+        # candidates (four times as many are taken when filtering).
+        candidates = max(self.rerank, k) * (4 if filter else 1)
+        ranked = [self._search_rows(np.asarray(vector, dtype=np.float32), candidates).tolist() for vector in embeddings]
+        found = self._fetch(sorted({row for rows in ranked for row in rows}))
+        results = []
+        for rows in ranked:
+            docs = []
+            for row in rows:
+                chunk_id, document, metadata = found[row]
+                if filter and any(metadata.get(key) != value for key, value in filter.items()):
+                    continue
+                docs.append(Document(page_content=document, metadata=metadata))
+                if len(docs) == k:
+                    break
+            results.append(docs)
+        return results
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, filter: Optional[Dict] = None, **kwargs: Any) -> List[Document]:
+        return self.search_batch([embedding], k, filter)[0]
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict] = None, **kwargs: Any) -> List[Document]:
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k, filter)
+
+    def get(self, ids: Optional[List[str]] = None, limit: Optional[int] = None, offset: Optional[int] = None,
+            include: Iterable[str] = ("documents", "metadatas")) -> Dict[str, list]:
+        # Same shape as Chroma.get, in row order.
+        with self.lock:
+            if ids is not None:
+                rows = []
+                for batch in batched(ids, LOOKUP_BATCH):
+                    rows.extend(self.conn.execute(
+                        f"SELECT row, id, document, metadata FROM rows WHERE live = 1 "
+                        f"AND id IN ({','.join('?' * len(batch))}) ORDER BY row", batch
+                    ))
+            else:
+                rows = self.conn.execute(
+                    "SELECT row, id, document, metadata FROM rows WHERE live = 1 ORDER BY row LIMIT ? OFFSET ?",
+                    (-1 if limit is None else limit, offset or 0)
+                ).fetchall()
+            vectors = self.vectors
+        result = {"ids": [chunk_id for _, chunk_id, _, _ in rows]}
+        if "documents" in include:
+            result["documents"] = [document for _, _, document, _ in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [json.loads(metadata) if metadata else {} for _, _, _, metadata in rows]
+        if "embeddings" in include:
+            result["embeddings"] = [np.asarray(vectors[row]).tolist() for row, _, _, _ in rows]
+        return result
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        import uuid
+        texts = list(texts)
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        self.upsert(ids, self.embeddings.embed_documents(texts), metadatas or [{} for _ in texts], texts)
+        return ids
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None, path: str = "./vector_db/ann", **kwargs: Any) -> "LocalANNStore":
+        store = cls(path, embedding, **kwargs)
+        store.add_texts(texts, metadatas)
+        return store
+
+    def memory_report(self) -> Dict[str, int]:
+        # Bytes on disk, and bytes scanned on every query (int8 codes, scales,
+        # norms, lists, centroids); float32 vectors are only paged in for
+        # re-ranked candidates.
+        files = {
+            name: os.path.getsize(self._file(name))
+            for name in sorted(os.listdir(self.path)) if os.path.isfile(self._file(name))
+        }
+        hot = sum(files.get(name, 0) for name in ("codes.i8", "scales.f32", "norms.f32", "lists.i32", "centroids.f32"))
+        return {"disk_bytes": sum(files.values()), "ram_bytes": hot, "vectors": len(self.scales), "live": self.count()}
+
+    def close(self) -> None:
+        self.conn.close()
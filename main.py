@@ -1,9 +1,11 @@
 import argparse
 import warnings
-from utils import load_config
+from concurrent.futures import ThreadPoolExecutor
+from utils import load_config, StartupProfiler
+from ingest_manifest import IngestManifest
 from run_chat import (
     load_documents, update_vectorstore,
-    setup_llm, handle_session, start_session
+    setup_llm, setup_answer_cache, setup_question_rewriter, handle_session, start_session
 )
 
 def main():
@@ -13,6 +15,8 @@ def main():
     parser.add_argument("--config", type=str, default="config.yaml", help="Config file path")
     parser.add_argument("--skip_update", action="store_true", help="Skip vectorstore update")
     parser.add_argument("--debug", action="store_true", help="Enable debug mode and show warnings.")
+    parser.add_argument("--profile-startup", action="store_true", help="Print a per-phase startup timing breakdown.")
+    parser.add_argument("--rebuild_catalog", action="store_true", help="Rebuild the session catalog from the session files and exit.")
 
 
     args = parser.parse_args()
@@ -21,22 +25,48 @@ def main():
         warnings.filterwarnings("ignore")
 
     config = load_config(args.config)
+    if args.rebuild_catalog:
+        from snapshot_manager import SnapshotManager
+        SnapshotManager(snapshot_dir=config.get("snapshot_path", "./snapshots")).rebuild_catalog()
+        return
+
     overrides = {
         "model_path": args.model_path,
         "temperature": args.temperature
     }
 
     # Chat session
+    profiler = StartupProfiler(enabled=args.profile_startup)
     print("🤖 Starting RAG chat agent...")
-    chunks = load_documents(config)
-    retriever = update_vectorstore(config, chunks, skip_update=args.skip_update)
-    llm = setup_llm(config, overrides)
 
-    config["retriever"] = retriever
-    config["llm_instance"] = llm
+    # The LLM loads (mmap'd by llama.cpp) on a background thread while
+    # documents sync and the user picks a session.
+    def load_llm():
+        with profiler.phase("LLM load (background)"):
+            return setup_llm(config, overrides)
+    llm_loader = ThreadPoolExecutor(max_workers=1)
+    llm_future = llm_loader.submit(load_llm)
+    llm_loader.shutdown(wait=False)
+
+    with profiler.phase("document scan"):
+        config["answer_cache_instance"] = setup_answer_cache(config)
+        config["question_rewriter_instance"] = setup_question_rewriter(config)
+        manifest = IngestManifest(config)
+        chunks = [] if args.skip_update else load_documents(config, manifest)
+    with profiler.phase("vectorstore sync"):
+        config["retriever"] = update_vectorstore(config, chunks, skip_update=args.skip_update, manifest=manifest)
 
-    snap, memory, = handle_session(config)
-    agent = start_session(config, memory)
+    with profiler.phase("session selection"):
+        snap, memory, = handle_session(config)
+    with profiler.phase("waiting for LLM"):
+        config["llm_instance"] = llm_future.result()
+    with profiler.phase("agent setup"):
+        agent = start_session(config, memory)
+
+    embedding_model = config["vs_manager"].embedding_model
+    if embedding_model.load_finished is not None:
+        profiler.add("embedding model load", embedding_model.load_started, embedding_model.load_finished)
+    profiler.report()
 
     print("\n🔍 Ask questions. Type 'exit' to quit, or use ::new / ::resume\n")
     has_activity = False
@@ -49,6 +79,14 @@ def main():
                 print("✅ Session saved before exit.\n")
             else:
                 print("🗑️ No activity detected. Session discarded.\n")
+            if config["answer_cache_instance"] is not None:
+                stats = config["answer_cache_instance"].stats()
+                print(f"🧠 Answer cache: {stats['hits']} hits, {stats['misses']} misses "
+                      f"({stats['hit_rate']:.0%} hit rate).")
+            if config["question_rewriter_instance"] is not None:
+                stats = config["question_rewriter_instance"].stats()
+                print(f"✏️ Question rewrites: {stats['invoked']} invoked, {stats['memo_hits']} memoized, "
+                      f"{sum(stats['skipped'].values())} skipped ({stats['seconds']:.1f}s total).")
             break
         
         elif user_input.lower() == "::new":
@@ -69,10 +107,29 @@ def main():
             has_activity = False
             continue
         
-        answer, sources = agent.ask(user_input)
-        print(f"\n\n💬 Answer:\n{answer}\n\n📚 Sources:")
+        print("\n\n💬 Answer:")
+        tokens, sources, timings = [], [], {}
+        for kind, payload in agent.ask_stream(user_input):
+            if kind == "token":
+                tokens.append(payload)
+                print(payload, end="", flush=True)
+            elif kind == "sources":
+                sources = payload
+            elif kind == "timings":
+                timings = payload
+        answer = "".join(tokens)
+
+        print("\n\n📚 Sources:")
         for s in sources:
+            if s.get("duplicate_of"):
+                print(f"   ↳ also in {s['file']} (Page {s['page']}, Chunk {s['chunk']})")
+                continue
             print(f" - {s['file']} (Page {s['page']}, Chunk {s['chunk']}):\n {s['text'][:150]}...\n")
+        # Stage timings are float seconds; token and turn counts are ints.
+        print("⏱️ " + " | ".join(
+            f"{name} {value * 1000:.0f}ms" if isinstance(value, float) else f"{name} {value}"
+            for name, value in timings.items()
+        ) + "\n")
         snap.record_turn(user_input, answer, sources)
         has_activity = True
 
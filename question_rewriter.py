@@ -0,0 +1,147 @@
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+from langchain_core.messages import BaseMessage
+from utils import compute_sha1
+
+CONTINUATION_RE = re.compile(
+    r"^\s*(and|but|also|so|then|or|what about|how about|what if|why not|same for|which one|the other)\b", re.IGNORECASE
+)
+REFERENCE_WORDS = {
+    "it", "its", "this", "that", "these", "those", "they", "them", "their", "there",
+    "he", "she", "him", "her", "his", "same", "above", "previous", "former", "latter",
+}
+WORD_RE = re.compile(r"[\w'-]+")
+# Questions this short may lean on the conversation even without "it" or
+# "that" ("Why?", "Example?"); the similarity check tells them apart.
+SHORT_QUESTION_WORDS = 4
+ANSWER_PREFIX_RE = re.compile(r"^\s*(standalone question|question)\s*:\s*", re.IGNORECASE)
+
+
+class QuestionRewriter:
+    # Turns follow-ups such as "what about page 3?" into standalone questions
+    # for retrieval with `question_rewrite_prompt`. The LLM is only asked when
+    # the question looks like it leans on the conversation:
+    #   - it opens like a continuation ("and ...", "what about ..."), or
+    #   - it refers back ("it", "those", ...) and its embedding is at least
+    #     `similarity_threshold` close to the previous exchange, or
+    #   - it is only a few words long and its embedding is further than that
+    #     from the previous exchange: "Why?" names no topic of its own, while
+    #     a short question that repeats the topic already stands alone.
+    # Rewrites are memoized per (history hash, question) and shared across
+    # sessions; the rewrite prompt sees at most `history_tokens` of recent
+    # history and may answer with at most `max_tokens`.
+    def __init__(self, prompt: str, max_tokens: int = 48, history_tokens: int = 256,
+                 similarity_threshold: float = 0.35, max_entries: int = 256):
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+        self.history_tokens = history_tokens
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.memo: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self.invoked = 0
+        self.memo_hits = 0
+        self.skipped: Dict[str, int] = {}
+        self.seconds = 0.0
+        self.llm_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def rewrite(
+        self, question: str, messages: List[BaseMessage], generate: Callable[[str, int], str],
+        count_tokens: Callable[[str], int], embed_query: Optional[Callable[[str], List[float]]] = None
+    ) -> Tuple[str, bool]:
+        # Returns (question for retrieval, whether it was rewritten).
+        # `embed_query` should bypass the chunk embedding cache; callers can
+        # memoize it to reuse the question's vector for retrieval.
+        start = time.perf_counter()
+        reason = self._skip_reason(question, messages, embed_query)
+        if reason is not None:
+            self._count(skipped=reason, seconds=time.perf_counter() - start)
+            return question, False
+
+        history = self._history_text(messages, count_tokens)
+        key = (compute_sha1(history), " ".join(question.lower().split()))
+        with self.lock:
+            rewritten = self.memo.get(key)
+            if rewritten is not None:
+                self.memo.move_to_end(key)
+        if rewritten is not None:
+            self._count(memo_hit=True, seconds=time.perf_counter() - start)
+            return rewritten, rewritten != question
+
+        llm_start = time.perf_counter()
+        output = generate(self.prompt.format(chat_history=history, question=question), self.max_tokens)
+        llm_seconds = time.perf_counter() - llm_start
+        rewritten = self._clean(output, question)
+        with self.lock:
+            self.memo[key] = rewritten
+            while len(self.memo) > self.max_entries:
+                self.memo.popitem(last=False)
+        self._count(invoked=True, seconds=time.perf_counter() - start, llm_seconds=llm_seconds)
+        return rewritten, rewritten != question
+
+    def _skip_reason(self, question: str, messages: List[BaseMessage],
+                     embed_query: Optional[Callable[[str], List[float]]]) -> Optional[str]:
+        if not messages:
+            return "no_history"
+        if CONTINUATION_RE.match(question):
+            return None
+        words = WORD_RE.findall(question.lower())
+        refers_back = bool(REFERENCE_WORDS.intersection(words))
+        if not refers_back and len(words) > SHORT_QUESTION_WORDS:
+            return "standalone"
+        if embed_query is None:
+            return None
+        # "Is it safe to ..." also refers back only if it stays on the topic
+        # of the last exchange.
+        last_exchange = " ".join(str(message.content) for message in messages[-2:])
+        q, h = embed_query(question), embed_query(last_exchange)
+        norm = (sum(x * x for x in q) * sum(x * x for x in h)) ** 0.5 or 1.0
+        on_topic = sum(a * b for a, b in zip(q, h)) / norm >= self.similarity_threshold
+        if refers_back:
+            return None if on_topic else "new_topic"
+        return "standalone" if on_topic else None
+
+    def _history_text(self, messages: List[BaseMessage], count_tokens: Callable[[str], int]) -> str:
+        # Most recent messages first until the budget is spent, then back in order.
+        lines, used = [], 0
+        for message in reversed(messages):
+            role = "User" if message.type == "human" else "Assistant"
+            line = f"{role}: {message.content}"
+            tokens = count_tokens(line)
+            if lines and used + tokens > self.history_tokens:
+                break
+            lines.append(line)
+            used += tokens
+        return "\n".join(reversed(lines))
+
+    @staticmethod
+    def _clean(output, question: str) -> str:
+        text = str(getattr(output, "content", output)).strip()
+        text = ANSWER_PREFIX_RE.sub("", text.splitlines()[0] if text else "").strip().strip('"').strip()
+        return text or question
+
+    def _count(self, skipped: Optional[str] = None, memo_hit: bool = False, invoked: bool = False,
+               seconds: float = 0.0, llm_seconds: float = 0.0) -> None:
+        with self.lock:
+            if skipped is not None:
+                self.skipped[skipped] = self.skipped.get(skipped, 0) + 1
+            self.memo_hits += memo_hit
+            self.invoked += invoked
+            self.seconds += seconds
+            self.llm_seconds += llm_seconds
+
+    def stats(self) -> Dict:
+        with self.lock:
+            checked = self.invoked + self.memo_hits + sum(self.skipped.values())
+            return {
+                "checked": checked,
+                "invoked": self.invoked,
+                "memo_hits": self.memo_hits,
+                "skipped": dict(self.skipped),
+                "seconds": self.seconds,
+                "llm_seconds": self.llm_seconds,
+                "avg_rewrite_ms": self.llm_seconds * 1000 / self.invoked if self.invoked else 0.0,
+            }
@@ -0,0 +1,89 @@
+import json
+import time
+import argparse
+import warnings
+from utils import load_config, batched
+from ingest_manifest import IngestManifest
+from run_chat import load_documents, update_vectorstore, setup_llm, setup_answer_cache, start_session
+
+
+def read_questions(path):
+    # One JSON object per line with a "question" field and an optional "id";
+    # plain-text lines are accepted as bare questions.
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                item = {"question": line}
+            if isinstance(item, str):
+                item = {"question": item}
+            item.setdefault("id", line_no)
+            yield item
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions in bulk")
+    parser.add_argument("--input", type=str, required=True, help="JSONL file of questions")
+    parser.add_argument("--output", type=str, default="batch_results.jsonl", help="JSONL file for answers")
+    parser.add_argument("--batch_size", type=int, default=256, help="Questions embedded and searched together")
+    parser.add_argument("--sequential", action="store_true", help="Answer one question at a time via ChatAgent.ask, for comparison")
+    parser.add_argument("--model_path", type=str, help="Override model path")
+    parser.add_argument("--temperature", type=float, help="Override LLM temperature")
+    parser.add_argument("--config", type=str, default="config.yaml", help="Config file path")
+    parser.add_argument("--skip_update", action="store_true", help="Skip vectorstore update")
+    parser.add_argument("--debug", action="store_true", help="Enable debug mode and show warnings.")
+    args = parser.parse_args()
+
+    if not args.debug:
+        warnings.filterwarnings("ignore")
+
+    from langchain.memory import ConversationBufferMemory
+    config = load_config(args.config)
+    config["answer_cache_instance"] = setup_answer_cache(config)
+    manifest = IngestManifest(config)
+    chunks = [] if args.skip_update else load_documents(config, manifest)
+    config["retriever"] = update_vectorstore(config, chunks, skip_update=args.skip_update, manifest=manifest)
+    config["llm_instance"] = setup_llm(config, {"model_path": args.model_path, "temperature": args.temperature})
+    memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+    agent = start_session(config, memory)
+
+    questions = list(read_questions(args.input))
+    print(f"📝 Answering {len(questions)} questions from {args.input} "
+          f"({'sequential' if args.sequential else f'batches of {args.batch_size}'})...")
+
+    start = time.perf_counter()
+    duplicates = 0
+    with open(args.output, "w", encoding="utf-8") as out:
+        for batch in batched(questions, args.batch_size):
+            if args.sequential:
+                results = []
+                for item in batch:
+                    memory.clear()
+                    results.append(agent.ask(item["question"]))
+            else:
+                results = agent.ask_batch([item["question"] for item in batch])
+
+            for item, (answer, sources, timings) in zip(batch, results):
+                duplicates += timings.get("duplicate", 0)
+                out.write(json.dumps({
+                    "id": item["id"],
+                    "question": item["question"],
+                    "answer": answer,
+                    "sources": sources,
+                    "timings": timings,
+                }) + "\n")
+            out.flush()
+            print(f"   ✔️ {len(batch)} answered")
+
+    elapsed = time.perf_counter() - start
+    print(f"⚡ Answered {len(questions)} questions in {elapsed:.1f}s "
+          f"({len(questions) / max(elapsed, 1e-9) * 60:.1f} questions/min, "
+          f"{duplicates} duplicates reused). Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import warnings
+from datetime import datetime, timezone
+from utils import load_config, batched
+from ingest_manifest import IngestManifest
+from run_chat import load_documents
+from vectorstore_manager import VectorstoreManager
+
+ENTRIES_PER_FILE = 50
+ADJECTIVES = ["thermal", "hydraulic", "optical", "acoustic", "magnetic", "pneumatic", "seismic", "cryogenic"]
+NOUNS = ["valve", "sensor", "relay", "pump", "actuator", "bearing", "coupler", "regulator"]
+UNITS = ["kPa", "volts", "rpm", "amperes", "newtons", "kelvin"]
+FILLER = (
+    "maintenance inspection schedule operator manual calibration procedure warranty supplier "
+    "installation tolerance clearance torque lubricant housing bracket assembly diagram revision "
+    "safety warning notice replacement interval storage shipping packaging label certificate"
+).split()
+
+
+def make_fact(i: int, chunk_chars: int):
+    # One labelled fact per entry, padded with filler to roughly one chunk.
+    rng = random.Random(i)
+    code = f"PN-{i:06d}"
+    part = f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}"
+    value, unit = rng.randint(10, 990), rng.choice(UNITS)
+    text = f"The {part} {code} is rated for {value} {unit}."
+    while len(text) < chunk_chars * 0.8:
+        text += " " + " ".join(rng.choice(FILLER) for _ in range(12)) + "."
+    question = f"What is the {part} {code} rated for?"
+    return {"text": text}, {"question": question, "relevant": [code]}
+
+
+def write_corpus(data_path: str, size: int, chunk_chars: int):
+    # Fact i lives in file i // ENTRIES_PER_FILE, so growing the corpus only
+    # adds files (or rewrites the last partial one).
+    os.makedirs(data_path, exist_ok=True)
+    labels = []
+    for file_index, indices in enumerate(batched(range(size), ENTRIES_PER_FILE)):
+        path = os.path.join(data_path, f"bench_{file_index:05d}.json")
+        entries = [make_fact(i, chunk_chars) for i in indices]
+        labels.extend(label for _, label in entries)
+        text = json.dumps([entry for entry, _ in entries])
+        if not os.path.exists(path) or open(path).read() != text:
+            with open(path, "w") as f:
+                f.write(text)
+    return labels
+
+
+def read_labels(path: str):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percentiles(values):
+    # Milliseconds, nearest rank.
+    values = sorted(v * 1000 for v in values)
+    if not values:
+        return {}
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "mean": sum(values) / len(values)}
+
+
+def dir_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path) for name in names
+    )
+
+
+def make_agent(config):
+    from chat_agent import ChatAgent
+    from langchain.memory import ConversationBufferMemory
+    from langchain_community.llms.fake import FakeListLLM
+
+    class StubLLM(FakeListLLM):
+        # Fixed answer, no model load; token counts approximated so the
+        # history window never reaches for a tokenizer download.
+        def get_num_tokens(self, text: str) -> int:
+            return len(text) // 4 + 1
+
+    llm = StubLLM(responses=["This is a stub answer."])
+    memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+    return ChatAgent(llm=llm, retriever=config["retriever"], memory=memory, config=config)
+
+
+def run_step(config, labels, args):
+    # Every step syncs into the same warmed-up manager, so ingest_s covers
+    # loading, splitting, embedding and writing but never model loading.
+    # Each step reads the manifest afresh, like a separate --update run.
+    vs_manager = config["vs_manager"]
+    before = vs_manager.backend.count()
+    start = time.perf_counter()
+    manifest = IngestManifest(config)
+    chunks = load_documents(config, manifest)
+    if manifest.pending or manifest.affected_files:
+        vs_manager.sync_documents(chunks, files=manifest.affected_files)
+    manifest.save()
+    ingest_s = time.perf_counter() - start
+    chunks = vs_manager.backend.count()
+    added = chunks - before
+    config["retriever"] = vs_manager.as_retriever()
+
+    agent = make_agent(config)
+    k = config.get("retrieval", {}).get("k", 3)
+    sample = random.Random(args.seed).sample(labels, min(args.queries, len(labels)))
+
+    retrieval_times, hits = [], 0
+    for label in sample:
+        query_start = time.perf_counter()
+        docs, _ = agent._retrieve(label["question"], {})
+        retrieval_times.append(time.perf_counter() - query_start)
+        hits += any(marker in doc.page_content or marker == doc.metadata.get("id")
+                    for doc in docs[:k] for marker in label["relevant"])
+
+    ask_times = []
+    for label in sample[:args.ask_queries]:
+        agent.memory.clear()
+        ask_start = time.perf_counter()
+        agent.ask(label["question"])
+        ask_times.append(time.perf_counter() - ask_start)
+
+    return {
+        "chunks": chunks,
+        "ingested_chunks": added,
+        "ingest_s": ingest_s,
+        "ingest_chunks_per_s": added / max(ingest_s, 1e-9),
+        "index_bytes": dir_size(config["vector_db_path"]),
+        "queries": len(sample),
+        "retrieval_ms": percentiles(retrieval_times),
+        f"recall_at_{k}": hits / len(sample) if sample else None,
+        "ask_ms": percentiles(ask_times),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingestion, retrieval latency and recall@k.")
+    parser.add_argument("--config", type=str, default="config.yaml", help="Config file path")
+    parser.add_argument("--sizes", type=str, default="500,2000,5000", help="Comma-separated synthetic corpus sizes (facts)")
+    parser.add_argument("--data_path", type=str, help="Benchmark a fixture corpus instead of a synthetic one")
+    parser.add_argument("--questions", type=str, help='JSONL of {"question": ..., "relevant": [chunk IDs or marker text]}')
+    parser.add_argument("--queries", type=int, default=200, help="Questions sampled per step for latency and recall")
+    parser.add_argument("--ask_queries", type=int, default=20, help="Questions answered end to end with the stub LLM")
+    parser.add_argument("--workdir", type=str, help="Keep the benchmark store here instead of a temp dir")
+    parser.add_argument("--output", type=str, default="benchmark_results.json", help="Where to write results")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--debug", action="store_true", help="Enable debug mode and show warnings.")
+    args = parser.parse_args()
+
+    if not args.debug:
+        warnings.filterwarnings("ignore")
+
+    config = load_config(args.config)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rag_bench_")
+    # Fresh store and embedding cache, so ingestion is measured cold.
+    config["vector_db_path"] = os.path.join(workdir, "vector_db")
+    config.setdefault("embedding", {})["cache_path"] = os.path.join(workdir, "embeddings.sqlite3")
+    chunk_chars = config.get("chunk", {}).get("size", 800)
+
+    if args.data_path:
+        config["data_path"] = args.data_path
+        steps = [None]
+        labels = read_labels(args.questions) if args.questions else []
+    else:
+        config["data_path"] = os.path.join(workdir, "data")
+        steps = [int(size) for size in args.sizes.split(",")]
+
+    results = []
+    vs_manager = VectorstoreManager(config)
+    vs_manager.warm_up()
+    vs_manager.load_vectorstore()
+    vs_manager.embedding_model.load()
+    config["vs_manager"] = vs_manager
+    try:
+        for size in steps:
+            step_labels = labels if size is None else write_corpus(config["data_path"], size, chunk_chars)
+            print(f"\n📏 Benchmark step: {size or config['data_path']} ...")
+            result = run_step(config, step_labels, args)
+            result["size"] = size
+            results.append(result)
+            print(f"   ⚡ {result['ingest_chunks_per_s']:.1f} chunks/s | {result['index_bytes'] / 1e6:.1f} MB | "
+                  f"retrieval p50 {result['retrieval_ms'].get('p50', 0):.1f}ms "
+                  f"p95 {result['retrieval_ms'].get('p95', 0):.1f}ms "
+                  f"p99 {result['retrieval_ms'].get('p99', 0):.1f}ms | "
+                  + " ".join(f"{key} {value:.2f}" for key, value in result.items() if key.startswith("recall_at_") and value is not None))
+    finally:
+        vs_manager.close()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "chunk": config.get("chunk", {}),
+        "embedding_model": config.get("embedding", {}).get("model_name"),
+        "retrieval": config.get("retrieval", {}),
+        "steps": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 Benchmark results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
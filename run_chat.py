@@ -1,32 +1,125 @@
-from vectorstore_manager import VectorstoreManager
-from chat_agent import ChatAgent
-from snapshot_manager import SnapshotManager
-from get_llm import get_local_llm
-from document_loader import SmartDocumentLoader
-from langchain.memory import ConversationBufferMemory
+# Heavy modules (langchain, chromadb, llama-cpp) are imported inside the
+# functions that need them so they load in parallel with other startup work.
+from answer_cache import AnswerCache
 
-def load_documents(config):
+def load_documents(config, manifest=None):
+    # With a manifest this returns a lazy stream of chunks from new or changed
+    # files; the manifest records each file's chunks as the stream is consumed.
+    from document_loader import SmartDocumentLoader
     loader = SmartDocumentLoader(config=config)
-    documents = loader.load()
-    return loader.split_documents(documents)
+    if manifest is None:
+        return loader.split_documents(loader.load())
 
-def update_vectorstore(config, chunks, skip_update=False):
+    files = loader.list_files()
+    changed, removed = manifest.scan(files)
+    print(f"📄 Found {len(files)} documents in {loader.path}: "
+          f"{len(changed)} new or changed, {len(removed)} removed")
+    for path in removed:
+        manifest.forget(path)
+    return _iter_changed_chunks(loader, changed, manifest)
+
+def _iter_changed_chunks(loader, files, manifest):
+    for path, docs in loader.iter_files(files):
+        file_chunks = list(loader.iter_split(docs))
+        manifest.record(path, file_chunks)
+        yield from file_chunks
+
+def update_vectorstore(config, chunks, skip_update=False, manifest=None):
+    from vectorstore_manager import VectorstoreManager
     vs_manager = VectorstoreManager(config)
+    vs_manager.warm_up()
     vs_manager.load_vectorstore()
-    if not skip_update and vs_manager.needs_update(chunks):
+    config["vs_manager"] = vs_manager
+    if config.get("answer_cache_instance") is not None:
+        vs_manager.add_listener(config["answer_cache_instance"].invalidate)
+    if skip_update:
+        print("✅ Vectorstore is up to date.")
+    elif manifest is not None:
+        # Replace the chunks of changed files and drop those of removed files.
+        if manifest.pending or manifest.affected_files:
+            vs_manager.sync_documents(chunks, files=manifest.affected_files)
+        else:
+            print("✅ Vectorstore is up to date.")
+        # Only persist the manifest once its chunks are in the store.
+        manifest.save()
+    elif vs_manager.needs_update(chunks):
         vs_manager.add_documents(chunks)
     else:
         print("✅ Vectorstore is up to date.")
-    return vs_manager.vs.as_retriever(search_kwargs={"k": 3})
+    return vs_manager.as_retriever()
 
 def setup_llm(config, overrides={}):
+    from get_llm import get_local_llm
     return get_local_llm(config, overrides)
 
-def start_session(config, memory):
-    return ChatAgent(config=config, llm=config["llm_instance"], retriever=config["retriever"], memory=memory)
+def setup_answer_cache(config):
+    cache_config = config.get("answer_cache", {})
+    if not cache_config.get("enabled", False):
+        return None
+    return AnswerCache(
+        threshold=cache_config.get("similarity_threshold", 0.95),
+        ttl_seconds=cache_config.get("ttl_seconds", 3600),
+        max_entries=cache_config.get("max_entries", 256),
+    )
+
+def setup_question_rewriter(config):
+    rewrite_config = config.get("question_rewrite", {})
+    if not rewrite_config.get("enabled", False):
+        return None
+    import yaml
+    from question_rewriter import QuestionRewriter
+    with open(config.get("prompt_path", "./prompts.yaml")) as f:
+        prompt = yaml.safe_load(f)["question_rewrite_prompt"]
+    return QuestionRewriter(
+        prompt,
+        max_tokens=rewrite_config.get("max_tokens", 48),
+        history_tokens=rewrite_config.get("history_tokens", 256),
+        similarity_threshold=rewrite_config.get("similarity_threshold", 0.35),
+        max_entries=rewrite_config.get("max_entries", 256),
+    )
+
+def start_session(config, memory, session_id=None):
+    from chat_agent import ChatAgent
+    return ChatAgent(
+        config=config, llm=config["llm_instance"], retriever=config["retriever"], memory=memory,
+        answer_cache=config.get("answer_cache_instance"),
+        scheduler=config.get("scheduler"), session_id=session_id,
+        question_rewriter=config.get("question_rewriter_instance")
+    )
+
+SESSION_PAGE_SIZE = 10
+
+def _pick_session(snap):
+    # Pages through the session catalog newest first; '/text' filters by
+    # alias or ID prefix.
+    page, search = 0, None
+    while True:
+        total = snap.count_sessions(search)
+        sessions = snap.list_sessions(limit=SESSION_PAGE_SIZE, offset=page * SESSION_PAGE_SIZE, search=search)
+        for i, s in enumerate(sessions, page * SESSION_PAGE_SIZE + 1):
+            print(f"{i}. Alias: {s['alias']}")
+            print(f"   ID: {s['id']}")
+            print(f"   Time: {s['modified']} ({s['turns']} turns)")
+            print(f"   Preview: {s['first_msg'][:80]}...\n")
+        pages = max(1, -(-total // SESSION_PAGE_SIZE))
+        print(f"📄 Page {page + 1}/{pages} ({total} sessions{f' matching {search!r}' if search else ''})")
+        session_key = input("Enter Alias or session ID to resume (n/p: next/previous page, /text: search): ").strip()
+        if session_key == "n" and page + 1 < pages:
+            page += 1
+        elif session_key == "p" and page > 0:
+            page -= 1
+        elif session_key.startswith("/"):
+            search, page = session_key[1:].strip() or None, 0
+        elif session_key not in ("n", "p"):
+            return session_key
 
 def handle_session(config, override=None):
-    snap = SnapshotManager(snapshot_dir=config.get("snapshot_path", "./snapshots"))
+    from snapshot_manager import SnapshotManager
+    from langchain.memory import ConversationBufferMemory
+    snap = SnapshotManager(
+        snapshot_dir=config.get("snapshot_path", "./snapshots"),
+        resume_turns=config.get("history", {}).get("resume_turns")
+    )
 
     if not override:
         print("\n🎯 Choose an option:\n1: Start new session\n2: Resume existing session\n3: Resume latest session")
@@ -43,18 +136,12 @@ def handle_session(config, override=None):
 
     # Resume existing session    
     elif choice == "2":
-        sessions = snap.list_sessions()
-        if not sessions:
+        if not snap.count_sessions():
             print("❌ No sessions found. Starting new session.")
             session_id = snap.start_new_session()
             memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
         else:
-            for i, s in enumerate(sessions): 
-                print(f"{i+1}. Alias: {s['alias']}")
-                print(f"   ID: {s['id']}")
-                print(f"   Time: {s['modified']}")
-                print(f"   Preview: {s['first_msg'][:80]}...\n")
-            session_key = input("Enter Alias or session ID to resume: ").strip()
+            session_key = _pick_session(snap)
             memory = snap.resume_session(session_key)
             if memory is None:
                 print("⚠️ Invalid ID/alias. Starting new session.")
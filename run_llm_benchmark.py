@@ -0,0 +1,83 @@
+import json
+import time
+import argparse
+import warnings
+from datetime import datetime, timezone
+from utils import load_config
+from get_llm import get_local_llm, detect_hardware
+
+# CLI setup
+parser = argparse.ArgumentParser(description="Sweep llama.cpp n_threads / n_batch and record tokens/s.")
+parser.add_argument("--config", type=str, default="config.yaml", help="Path to config file.")
+parser.add_argument("--model_path", type=str, help="Override model path")
+parser.add_argument("--threads", type=str, default="auto", help="Comma-separated n_threads values, e.g. 2,4,6,8")
+parser.add_argument("--batch", type=str, default="128,256,512", help="Comma-separated n_batch values.")
+parser.add_argument("--prompt_tokens", type=int, default=512, help="Approximate prompt length to prefill.")
+parser.add_argument("--gen_tokens", type=int, default=64, help="Tokens to generate per run.")
+parser.add_argument("--output", type=str, default="llm_benchmark.json", help="Where to write results.")
+parser.add_argument("--debug", action="store_true", help="Enable debug mode and show warnings.")
+
+args = parser.parse_args()
+
+if not args.debug:
+    warnings.filterwarnings("ignore")
+
+config = load_config(args.config)
+# Every run must prefill from scratch, so no prompt state is carried over.
+config.setdefault("llm", {})["prompt_cache_mb"] = 0
+
+hardware = detect_hardware()
+if args.threads == "auto":
+    physical = hardware["physical_cores"]
+    thread_values = sorted({max(1, physical // 2), physical, hardware["logical_cores"]})
+else:
+    thread_values = [int(t) for t in args.threads.split(",")]
+batch_values = [int(b) for b in args.batch.split(",")]
+
+prompt = "The quick brown fox jumps over the lazy dog. " * max(1, args.prompt_tokens // 10)
+results = []
+
+for n_threads in thread_values:
+    for n_batch in batch_values:
+        llm = get_local_llm(config, {"model_path": args.model_path, "n_threads": n_threads, "n_batch": n_batch})
+        client = llm.client
+
+        start = time.perf_counter()
+        first_token = None
+        completion_tokens = 0
+        for _ in client.create_completion(prompt, max_tokens=args.gen_tokens, temperature=0.0, stream=True):
+            if first_token is None:
+                first_token = time.perf_counter()
+            completion_tokens += 1
+        end = time.perf_counter()
+
+        prompt_tokens = len(client.tokenize(prompt.encode("utf-8")))
+        first_token = first_token or end
+        result = {
+            "n_threads": n_threads,
+            "n_batch": n_batch,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "prefill_tokens_per_s": prompt_tokens / max(first_token - start, 1e-9),
+            "generate_tokens_per_s": max(completion_tokens - 1, 0) / max(end - first_token, 1e-9),
+            "time_to_first_token_s": first_token - start,
+            "total_s": end - start,
+        }
+        results.append(result)
+        print(f"⚙️ threads={n_threads:<3} batch={n_batch:<4} "
+              f"prefill {result['prefill_tokens_per_s']:7.1f} tok/s | "
+              f"generate {result['generate_tokens_per_s']:6.1f} tok/s")
+        del llm, client
+
+best = max(results, key=lambda r: r["generate_tokens_per_s"])
+print(f"🏆 Fastest generation: n_threads={best['n_threads']}, n_batch={best['n_batch']} "
+      f"({best['generate_tokens_per_s']:.1f} tok/s). Set these under llm: in config.yaml.")
+
+with open(args.output, "w") as f:
+    json.dump({
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "model_path": args.model_path or config["llm"].get("local_model_path"),
+        "hardware": hardware,
+        "results": results,
+    }, f, indent=2)
+print(f"💾 Results written to {args.output}")
@@ -0,0 +1,227 @@
+import json
+import argparse
+import threading
+import warnings
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Optional
+from utils import load_config
+from ingest_manifest import IngestManifest
+from scheduler import GenerationScheduler
+from run_chat import load_documents, update_vectorstore, setup_llm, setup_answer_cache, setup_question_rewriter, start_session
+
+
+class SessionPool:
+    # Chat sessions served by one process. All sessions share the LLM, the
+    # retriever and the answer cache from `config`; each has its own memory,
+    # snapshot and lock so that turns within a session stay ordered.
+    def __init__(self, config: dict):
+        self.config = config
+        self.snapshot_dir = config.get("snapshot_path", "./snapshots")
+        self.sessions: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+        # Serializes open() so a session is never resumed twice; ask() and
+        # close() only take `lock`.
+        self.open_lock = threading.Lock()
+
+    def open(self, alias: Optional[str] = None, resume: Optional[str] = None) -> dict:
+        # Resuming a session that is already open returns its handle, so a
+        # second agent and snapshot never append to the same session log.
+        with self.open_lock:
+            return self._open(alias, resume)
+
+    def _open(self, alias: Optional[str], resume: Optional[str]) -> dict:
+        from snapshot_manager import SnapshotManager
+        from langchain.memory import ConversationBufferMemory
+        snap = SnapshotManager(
+            snapshot_dir=self.snapshot_dir,
+            resume_turns=self.config.get("history", {}).get("resume_turns")
+        )
+        if resume:
+            entry = snap.catalog.resolve(resume)
+            with self.lock:
+                session = self.sessions.get(entry["id"]) if entry else None
+            if session is not None:
+                return {"session_id": entry["id"], "alias": session["snap"].metadata.get("alias"),
+                        "resumed": True, "already_open": True}
+        memory = snap.resume_session(resume) if resume else None
+        if memory is None:
+            if resume:
+                raise KeyError(resume)
+            snap.start_new_session(alias=alias)
+            memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+
+        session_id = snap.session_id
+        with self.lock:
+            self.sessions[session_id] = {
+                "snap": snap,
+                "agent": start_session(self.config, memory, session_id=session_id),
+                "lock": threading.Lock(),
+            }
+        return {"session_id": session_id, "alias": snap.metadata.get("alias"), "resumed": bool(resume), "already_open": False}
+
+    def _get(self, session_id: str) -> dict:
+        with self.lock:
+            session = self.sessions.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        return session
+
+    def ask(self, session_id: str, question: str) -> dict:
+        # Embedding and retrieval run on the request thread; only generation
+        # goes through the shared scheduler.
+        session = self._get(session_id)
+        with session["lock"]:
+            answer, sources, timings = session["agent"].ask(question)
+            session["snap"].record_turn(question, answer, sources)
+        return {"answer": answer, "sources": sources, "timings": timings}
+
+    def close(self, session_id: str) -> None:
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+        if session is None:
+            raise KeyError(session_id)
+        with session["lock"]:
+            session["snap"].save_snapshot()
+
+    def close_all(self) -> None:
+        for session_id in [session["session_id"] for session in self.list()]:
+            self.close(session_id)
+
+    def list(self):
+        with self.lock:
+            return [
+                {"session_id": sid, "alias": session["snap"].metadata.get("alias"),
+                 "turns": session["snap"].turns}
+                for sid, session in self.sessions.items()
+            ]
+
+
+class ChatRequestHandler(BaseHTTPRequestHandler):
+    # POST   /sessions              {"alias": ..., "resume": ...} -> new session (or the open one)
+    # GET    /sessions              -> open sessions
+    # POST   /sessions/<id>/ask     {"question": ...} -> answer, sources, timings
+    # DELETE /sessions/<id>         -> close a session
+    # GET    /metrics               -> scheduler queue depth and wait times, cache and rewrite stats
+    pool: SessionPool = None
+    config: dict = None
+
+    def _send(self, status: int, payload) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+    def _parts(self):
+        return [part for part in self.path.split("?")[0].split("/") if part]
+
+    def do_GET(self):
+        parts = self._parts()
+        if parts == ["metrics"]:
+            cache = self.config.get("answer_cache_instance")
+            rewriter = self.config.get("question_rewriter_instance")
+            self._send(200, {
+                "sessions": len(self.pool.list()),
+                "scheduler": self.config["scheduler"].stats(),
+                "answer_cache": cache.stats() if cache is not None else None,
+                "question_rewrite": rewriter.stats() if rewriter is not None else None,
+            })
+        elif parts == ["sessions"]:
+            self._send(200, {"sessions": self.pool.list()})
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        parts = self._parts()
+        try:
+            body = self._read_json()
+        except (ValueError, UnicodeDecodeError):
+            self._send(400, {"error": "invalid JSON body"})
+            return
+        try:
+            if parts == ["sessions"]:
+                handle = self.pool.open(alias=body.get("alias"), resume=body.get("resume"))
+                self._send(200 if handle["already_open"] else 201, handle)
+            elif len(parts) == 3 and parts[0] == "sessions" and parts[2] == "ask":
+                question = (body.get("question") or "").strip()
+                if not question:
+                    self._send(400, {"error": "missing 'question'"})
+                    return
+                self._send(200, self.pool.ask(parts[1], question))
+            else:
+                self._send(404, {"error": "not found"})
+        except KeyError as e:
+            self._send(404, {"error": f"unknown session {e.args[0]}"})
+        except Exception as e:
+            self._send(500, {"error": str(e)})
+
+    def do_DELETE(self):
+        parts = self._parts()
+        if len(parts) != 2 or parts[0] != "sessions":
+            self._send(404, {"error": "not found"})
+            return
+        try:
+            self.pool.close(parts[1])
+            self._send(200, {"closed": parts[1]})
+        except KeyError:
+            self._send(404, {"error": f"unknown session {parts[1]}"})
+
+    def log_message(self, format, *args):
+        if self.config.get("debug"):
+            super().log_message(format, *args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-session RAG chat server")
+    parser.add_argument("--model_path", type=str, help="Override model path")
+    parser.add_argument("--temperature", type=float, help="Override LLM temperature")
+    parser.add_argument("--config", type=str, default="config.yaml", help="Config file path")
+    parser.add_argument("--host", type=str, help="Override server.host")
+    parser.add_argument("--port", type=int, help="Override server.port")
+    parser.add_argument("--skip_update", action="store_true", help="Skip vectorstore update")
+    parser.add_argument("--debug", action="store_true", help="Enable debug mode, warnings and request logs.")
+    args = parser.parse_args()
+
+    if not args.debug:
+        warnings.filterwarnings("ignore")
+
+    config = load_config(args.config)
+    config["debug"] = args.debug
+    server_config = config.get("server", {})
+    host = args.host or server_config.get("host", "127.0.0.1")
+    port = args.port or server_config.get("port", 8000)
+
+    print("🤖 Starting RAG chat server...")
+    config["answer_cache_instance"] = setup_answer_cache(config)
+    config["question_rewriter_instance"] = setup_question_rewriter(config)
+    manifest = IngestManifest(config)
+    chunks = [] if args.skip_update else load_documents(config, manifest)
+    config["retriever"] = update_vectorstore(config, chunks, skip_update=args.skip_update, manifest=manifest)
+    config["llm_instance"] = setup_llm(config, {"model_path": args.model_path, "temperature": args.temperature})
+    config["scheduler"] = GenerationScheduler()
+
+    ChatRequestHandler.pool = SessionPool(config)
+    ChatRequestHandler.config = config
+    server = ThreadingHTTPServer((host, port), ChatRequestHandler)
+    server.daemon_threads = True
+    print(f"🌐 Serving on http://{host}:{port} (POST /sessions, POST /sessions/<id>/ask, GET /metrics)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Shutting down.")
+    finally:
+        server.server_close()
+        ChatRequestHandler.pool.close_all()
+        config["scheduler"].shutdown()
+        stats = config["scheduler"].stats()
+        print(f"📊 Served {stats['completed']} generations "
+              f"(p95 queue wait {stats['wait_p95_s'] * 1000:.0f}ms).")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,52 +3,66 @@ import warnings
 from tqdm import tqdm
 from utils import load_config
 from vectorstore_manager import VectorstoreManager
-from document_loader import SmartDocumentLoader
+from ingest_manifest import IngestManifest
+from run_chat import load_documents
 
-# CLI setup
-parser = argparse.ArgumentParser(description="Manage vectorstore lifecycle.")
-parser.add_argument("--update", action="store_true", help="Update vectorstore with only new documents.")
-parser.add_argument("--delete", action="store_true", help="Delete the existing vectorstore.")
-parser.add_argument("--reset", action="store_true", help="Delete and rebuild the vectorstore.")
-parser.add_argument("--config", type=str, default="config.yaml", help="Path to config file.")
-parser.add_argument("--debug", action="store_true", help="Enable debug mode and show warnings.")
 
-args = parser.parse_args()
+def main():
+    # CLI setup
+    parser = argparse.ArgumentParser(description="Manage vectorstore lifecycle.")
+    parser.add_argument("--update", action="store_true", help="Update vectorstore with new or changed documents.")
+    parser.add_argument("--sync", action="store_true", help="Reload all documents and make the vectorstore match them exactly.")
+    parser.add_argument("--delete", action="store_true", help="Delete the existing vectorstore.")
+    parser.add_argument("--reset", action="store_true", help="Delete and rebuild the vectorstore.")
+    parser.add_argument("--migrate", type=str, choices=["chroma", "local_ann"], help="Copy the vectorstore into another backend and report memory and recall.")
+    parser.add_argument("--config", type=str, default="config.yaml", help="Path to config file.")
+    parser.add_argument("--debug", action="store_true", help="Enable debug mode and show warnings.")
 
-if not args.debug:
+    args = parser.parse_args()
+
+    if not args.debug:
         warnings.filterwarnings("ignore")
 
-if not (args.update or args.delete or args.reset):
-    parser.print_help()
-    exit(0)
+    if not (args.update or args.sync or args.delete or args.reset or args.migrate):
+        parser.print_help()
+        return
+
+    # Load config
+    config = load_config(args.config)
+    vs_manager = VectorstoreManager(config)
 
-# Load config
-config = load_config(args.config)
-vs_manager = VectorstoreManager(config)
+    # DELETE operation
+    if args.delete:
+        vs_manager.delete_vectorstore()
+        return
 
-# DELETE operation
-if args.delete:
-    vs_manager.delete_vectorstore()
-    exit(0)
+    # MIGRATE operation
+    if args.migrate:
+        vs_manager.migrate(args.migrate)
+        return
 
-# RESET operation
-if args.reset:
-    print("🔄 Resetting vectorstore...")
-    vs_manager.delete_vectorstore()
+    # RESET operation
+    if args.reset:
+        print("🔄 Resetting vectorstore...")
+        vs_manager.delete_vectorstore()
 
-# Use Smart Loader
-loader = SmartDocumentLoader(config=config)
-documents = loader.load()
-#print(f"📄 Loaded {len(documents)} documents from multiple sources.")
+    # Load only new or changed documents, tracked by the ingestion manifest.
+    # --sync rebuilds the manifest from every document on disk.
+    manifest = IngestManifest(config)
+    if args.sync:
+        manifest.clear()
+    chunks = load_documents(config, manifest)
 
-# Chunking
-#print("🔪 Splitting into chunks...")
-chunks = loader.split_documents(documents)
+    # Add new chunks and remove stale ones
+    vs_manager.load_vectorstore()
+    if args.sync:
+        vs_manager.sync_documents(chunks)
+    elif manifest.pending or manifest.affected_files:
+        vs_manager.sync_documents(chunks, files=manifest.affected_files)
+    else:
+        print("✅ Your knowledge base is already up to date.")
+    manifest.save()
 
-# Add to vectorstore
-vs_manager.load_vectorstore()
-if vs_manager.needs_update(chunks):
-    vs_manager.add_documents(chunks)
-else:
-    print("✅ Your knowledge base is already up to date.")
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import time
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, Tuple
+
+Job = Tuple[Callable[[], Any], Future, float]
+
+
+class GenerationScheduler:
+    # Runs LLM generations one at a time on a single worker thread. Each
+    # session has its own FIFO queue and sessions are served round-robin, so
+    # one busy session can't starve the others.
+    def __init__(self, max_samples: int = 1000):
+        self.queues: "OrderedDict[str, Deque[Job]]" = OrderedDict()
+        self.cond = threading.Condition()
+        self.running = False
+        self.completed = 0
+        self.failed = 0
+        self.wait_times: Deque[float] = deque(maxlen=max_samples)
+        self.run_times: Deque[float] = deque(maxlen=max_samples)
+        self.closed = False
+        self.worker = threading.Thread(target=self._run, name="generation-scheduler", daemon=True)
+        self.worker.start()
+
+    def submit(self, session_id: str, fn: Callable[[], Any]) -> Future:
+        future: Future = Future()
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("Scheduler is shut down.")
+            self.queues.setdefault(session_id, deque()).append((fn, future, time.perf_counter()))
+            self.cond.notify()
+        return future
+
+    def run(self, session_id: str, fn: Callable[[], Any]) -> Tuple[Any, float]:
+        # Blocks until `fn` has run; returns (result, seconds spent queued).
+        submitted = time.perf_counter()
+        holder = {}
+
+        def timed():
+            holder["started"] = time.perf_counter()
+            return fn()
+
+        result = self.submit(session_id, timed).result()
+        return result, holder["started"] - submitted
+
+    def _next_job(self) -> Job:
+        session_id, jobs = self.queues.popitem(last=False)
+        job = jobs.popleft()
+        if jobs:
+            self.queues[session_id] = jobs  # back of the round-robin order
+        return job
+
+    def _run(self) -> None:
+        while True:
+            with self.cond:
+                while not self.queues and not self.closed:
+                    self.cond.wait()
+                if self.closed and not self.queues:
+                    return
+                fn, future, enqueued = self._next_job()
+                self.running = True
+
+            started = time.perf_counter()
+            self.wait_times.append(started - enqueued)
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn())
+                    self.completed += 1
+                except BaseException as e:
+                    future.set_exception(e)
+                    self.failed += 1
+            self.run_times.append(time.perf_counter() - started)
+            with self.cond:
+                self.running = False
+
+    def shutdown(self) -> None:
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.worker.join()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.cond:
+            depth = sum(len(jobs) for jobs in self.queues.values())
+            sessions_waiting = len(self.queues)
+            running = self.running
+        waits = sorted(self.wait_times)
+        runs = list(self.run_times)
+
+        def percentile(values, q):
+            return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+        return {
+            "queue_depth": depth,
+            "sessions_waiting": sessions_waiting,
+            "running": running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "wait_p50_s": percentile(waits, 0.50),
+            "wait_p95_s": percentile(waits, 0.95),
+            "wait_max_s": waits[-1] if waits else 0.0,
+            "generate_avg_s": sum(runs) / len(runs) if runs else 0.0,
+        }
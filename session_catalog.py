@@ -0,0 +1,116 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional
+
+COLUMNS = ("id", "alias", "created", "modified", "turns", "preview", "file")
+PREVIEW_CHARS = 200
+
+
+class SessionCatalog:
+    # One row per saved session with everything the resume menu shows, so
+    # listing and searching never open the session logs. Updated as turns are
+    # recorded; SnapshotManager.rebuild_catalog() recreates it from the logs.
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "id TEXT PRIMARY KEY, alias TEXT NOT NULL, created TEXT, modified TEXT, "
+            "turns INTEGER NOT NULL DEFAULT 0, preview TEXT NOT NULL DEFAULT '', file TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS sessions_modified ON sessions (modified)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS sessions_alias ON sessions (alias)")
+        self.conn.commit()
+
+    def _row(self, row) -> Dict:
+        return dict(zip(COLUMNS, row))
+
+    def is_empty(self) -> bool:
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM sessions LIMIT 1").fetchone() is None
+
+    def upsert(self, meta: Dict, turns: int, preview: str) -> None:
+        with self.lock:
+            self._upsert_rows([(meta, turns, preview)])
+            self.conn.commit()
+
+    def _upsert_rows(self, rows: Iterable) -> None:
+        self.conn.executemany(
+            "INSERT INTO sessions (id, alias, created, modified, turns, preview, file) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET "
+            "alias = excluded.alias, created = excluded.created, modified = excluded.modified, "
+            "turns = excluded.turns, preview = excluded.preview, file = excluded.file",
+            [
+                (meta["session_id"], meta["alias"], meta.get("created"), meta.get("modified"),
+                 turns, preview[:PREVIEW_CHARS], meta["file"])
+                for meta, turns, preview in rows
+            ]
+        )
+
+    def record_turn(self, session_id: str, modified: str) -> None:
+        with self.lock:
+            self.conn.execute(
+                "UPDATE sessions SET turns = turns + 1, modified = ? WHERE id = ?", (modified, session_id)
+            )
+            self.conn.commit()
+
+    def set_file(self, session_id: str, path: str) -> None:
+        with self.lock:
+            self.conn.execute("UPDATE sessions SET file = ? WHERE id = ?", (path, session_id))
+            self.conn.commit()
+
+    def replace_all(self, rows: Iterable) -> int:
+        rows = list(rows)
+        with self.lock:
+            self.conn.execute("DELETE FROM sessions")
+            self._upsert_rows(rows)
+            self.conn.commit()
+        return len(rows)
+
+    def resolve(self, identifier: str) -> Optional[Dict]:
+        # Exact alias (newest first), then exact ID, then a unique ID prefix.
+        with self.lock:
+            for where, args in (
+                ("alias = ?", (identifier,)),
+                ("id = ?", (identifier,)),
+                ("id LIKE ? ESCAPE '\\'", (self._prefix(identifier),)),
+            ):
+                rows = self.conn.execute(
+                    f"SELECT {', '.join(COLUMNS)} FROM sessions WHERE {where} ORDER BY modified DESC LIMIT 2", args
+                ).fetchall()
+                if len(rows) == 1 or (rows and where != "id LIKE ? ESCAPE '\\'"):
+                    return self._row(rows[0])
+        return None
+
+    @staticmethod
+    def _prefix(text: str) -> str:
+        return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+    def _search(self, search: Optional[str]):
+        if not search:
+            return "", ()
+        prefix = self._prefix(search)
+        return "WHERE alias LIKE ? ESCAPE '\\' OR id LIKE ? ESCAPE '\\'", (prefix, prefix)
+
+    def list(self, limit: Optional[int] = None, offset: int = 0, search: Optional[str] = None) -> List[Dict]:
+        # Newest first; `search` matches a prefix of the alias or session ID.
+        where, args = self._search(search)
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM sessions {where} "
+                f"ORDER BY COALESCE(modified, created) DESC LIMIT ? OFFSET ?",
+                args + (-1 if limit is None else limit, offset)
+            ).fetchall()
+        return [self._row(row) for row in rows]
+
+    def count(self, search: Optional[str] = None) -> int:
+        where, args = self._search(search)
+        with self.lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM sessions {where}", args).fetchone()[0]
+
+    def close(self) -> None:
+        self.conn.close()
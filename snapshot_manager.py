@@ -1,14 +1,31 @@
 import os
 import json
 import uuid
+import tempfile
+import threading
+from collections import deque
 from datetime import datetime, timezone
 from typing import List, Dict, Optional
 from langchain.schema import AIMessage, HumanMessage
 from langchain.memory import ConversationBufferMemory
+from session_catalog import SessionCatalog
+
+# Sources are logged by reference; the chunk text stays in the vectorstore.
+SOURCE_FIELDS = ("id", "file", "page", "chunk", "duplicate_of", "spans")
 
 
 class SnapshotManager:
-    def __init__(self, snapshot_dir: str = "./snapshots"):
+    # Each session is an append-only JSONL log with one line per turn, written
+    # as the turn happens. sessions.json and aliases.json are only rewritten
+    # when a session is registered or closed, always via temp file + rename.
+    # Older sessions saved as a single .json file are still read and are
+    # converted to logs in the background. Listing and lookups go through a
+    # SQLite catalog shared by every manager on the same snapshot_dir.
+    metadata_lock = threading.Lock()
+    compacted_dirs = set()
+    catalogs: Dict[str, SessionCatalog] = {}
+
+    def __init__(self, snapshot_dir: str = "./snapshots", resume_turns: Optional[int] = None):
         self.snapshot_dir = snapshot_dir
         self.session_dir = os.path.join(snapshot_dir, "sessions")
         self.metadata_dir = os.path.join(snapshot_dir, "metadata")
@@ -16,30 +33,79 @@ class SnapshotManager:
         os.makedirs(self.metadata_dir, exist_ok=True)
         self.alias_file = os.path.join(self.metadata_dir, "aliases.json")
         self.session_file = os.path.join(self.metadata_dir, "sessions.json")
-        
+
         self.alias_map = self._load_json(self.alias_file)
         self.sessions_meta = self._load_json(self.session_file)
-        
+
         self.session_id = None
         self.session_path = None
         self.history = []
         self.metadata = {}
-        
+        self.turns = 0
+        self.preview = ""
+        self.registered = False
+        # Only the most recent turns are replayed into memory on resume.
+        self.resume_turns = resume_turns
+
+        with self.metadata_lock:
+            start_compaction = snapshot_dir not in self.compacted_dirs
+            self.compacted_dirs.add(snapshot_dir)
+            catalog_path = os.path.join(self.metadata_dir, "sessions.sqlite3")
+            if catalog_path not in self.catalogs:
+                self.catalogs[catalog_path] = SessionCatalog(catalog_path)
+            self.catalog = self.catalogs[catalog_path]
+        if self.catalog.is_empty() and (self.sessions_meta or os.listdir(self.session_dir)):
+            self.rebuild_catalog()
+        if start_compaction:
+            threading.Thread(target=self.compact, name="snapshot-compaction", daemon=True).start()
+
     def _load_json(self, path: str) -> dict:
         if os.path.exists(path):
             with open(path, "r") as f:
                 return json.load(f)
         return {}
 
+    def _write_atomic(self, path: str, text: str):
+        # Readers (and a crash mid-write) see either the old or the new file.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
     def _save_json(self, path: str, data: dict):
-        with open(path, "w") as f:
-            json.dump(data, f, indent=2)
-            
+        self._write_atomic(path, json.dumps(data, indent=2))
+
+    def _refresh(self):
+        self.alias_map = self._load_json(self.alias_file)
+        self.sessions_meta = self._load_json(self.session_file)
+
+    def _update_metadata(self):
+        # Merge into the metadata currently on disk; other processes or
+        # server sessions may have saved since this manager loaded it.
+        with self.metadata_lock:
+            self._refresh()
+            self.sessions_meta[self.session_id] = self.metadata
+            self.alias_map[self.metadata["alias"]] = self.session_id
+            self._save_json(self.session_file, self.sessions_meta)
+            self._save_json(self.alias_file, self.alias_map)
+        self.catalog.upsert(self.metadata, self.turns, self.preview)
+        self.registered = True
+
     def start_new_session(self, alias: Optional[str] = None) -> str:
         self.session_id = str(uuid.uuid4())
-        self.session_path = os.path.join(self.session_dir, f"{self.session_id}.json")
+        self.session_path = os.path.join(self.session_dir, f"{self.session_id}.jsonl")
         self.history = []
-        
+        self.turns = 0
+        self.preview = ""
+        self.registered = False
+
         now = datetime.now(timezone.utc).isoformat()
         alias = alias or self.session_id
 
@@ -50,114 +116,179 @@ class SnapshotManager:
             "modified": now,
             "file": self.session_path
         }
-        
-        #self.sessions_meta[self.session_id] = self.metadata
-        #self.alias_map[alias] = self.session_id
-        #self._save_json(self.session_file, self.sessions_meta)
-        #self._save_json(self.alias_file, self.alias_map)
-        
+
+        # Nothing is written until the first turn, so empty sessions leave no trace.
         return self.session_id
 
     def resume_session(self, identifier: str) -> Optional[ConversationBufferMemory]:
-        session_id = self.alias_map.get(identifier, identifier)
-        meta = self.sessions_meta.get(session_id)
-
-        if not meta:
+        entry = self.catalog.resolve(identifier)
+        if not entry:
             print("❌ Session not found.")
             return None
-        
-        self.session_id = session_id
-        self.session_path = meta["file"]
-        self.metadata = meta
 
-        if not os.path.exists(self.session_path):
+        if not os.path.exists(entry["file"]):
             print("❌ Session file missing.")
             return None
 
         try:
-            with open(self.session_path, "r") as f:
-                data = json.load(f)
-                self.history = data.get("history", [])
+            if entry["file"].endswith(".json"):
+                entry["file"] = self._migrate(entry["id"])["file"]
+            self.history = self._read_log(entry["file"], repair=True, last=self.resume_turns)
         except Exception:
             print("⚠️ Failed to load session history.")
             return None
 
+        self.session_id = entry["id"]
+        self.session_path = entry["file"]
+        self.metadata = {
+            "session_id": entry["id"],
+            "alias": entry["alias"],
+            "created": entry["created"],
+            "modified": entry["modified"],
+            "file": entry["file"]
+        }
+        self.turns = entry["turns"]
+        self.preview = entry["preview"]
+        self.registered = True
+
         memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-        
+
         for item in self.history:
             memory.chat_memory.add_user_message(HumanMessage(content=item["question"]))
             memory.chat_memory.add_ai_message(AIMessage(content=item["answer"]))
-        
+
         return memory
-    
+
     def resume_latest(self) -> Optional[ConversationBufferMemory]:
-        sessions = self.list_sessions()
+        sessions = self.list_sessions(limit=1)
         if not sessions:
             print("❌ No sessions found.")
             return None
         return self.resume_session(sessions[0]["id"])
-    
-    def list_sessions(self) -> List[Dict]:
-        sessions = []
-        for sid, meta in self.sessions_meta.items():
+
+    def list_sessions(self, limit: Optional[int] = None, offset: int = 0, search: Optional[str] = None) -> List[Dict]:
+        return [{
+            "id": entry["id"],
+            "alias": entry["alias"],
+            "created": entry["created"],
+            "modified": entry["modified"],
+            "turns": entry["turns"],
+            "first_msg": entry["preview"]
+        } for entry in self.catalog.list(limit=limit, offset=offset, search=search)]
+
+    def count_sessions(self, search: Optional[str] = None) -> int:
+        return self.catalog.count(search)
+
+    def rebuild_catalog(self) -> int:
+        # Recreates the catalog from the session files, taking alias and
+        # timestamps from sessions.json where it still has them.
+        self._refresh()
+        rows = []
+        for name in sorted(os.listdir(self.session_dir)):
+            session_id, ext = os.path.splitext(name)
+            if ext not in (".json", ".jsonl"):
+                continue
+            path = os.path.join(self.session_dir, name)
             try:
-                created = meta.get("created")
-                modified = meta.get("modified")
-                alias = meta.get("alias", sid)
-                file_path = meta.get("file")
-                
-                if os.path.exists(file_path):
-                    with open(file_path, "r") as f:
-                        data = json.load(f)
-                    history = data.get("history", [])
-                    first_msg = history[0]["question"] if history else ""
+                if ext == ".json":
+                    with open(path, "r") as f:
+                        history = json.load(f).get("history", [])
                 else:
-                    first_msg = "(missing session file)"
-
+                    history = self._read_log(path)
             except Exception:
-                created = modified = None
-                alias = sid
-                first_msg = "(corrupt or empty)"
-                
-            sessions.append({
-                "id": sid,
-                "alias": alias,
-                "created": created,
-                "modified": modified,
-                "first_msg": first_msg
+                continue
+            mtime = datetime.fromtimestamp(os.path.getmtime(path), timezone.utc).isoformat()
+            meta = dict(self.sessions_meta.get(session_id) or {
+                "alias": session_id,
+                "created": history[0].get("time", mtime) if history else mtime,
+                "modified": mtime,
             })
-                
-        def sort_key(s):
-            return s.get("modified") or s.get("created")
-  
-        return sorted(sessions, key=sort_key, reverse=True)
+            last_turn = history[-1].get("time", "") if history else ""
+            meta.update(session_id=session_id, file=path, modified=max(meta.get("modified") or "", last_turn))
+            rows.append((meta, len(history), history[0]["question"] if history else ""))
+        count = self.catalog.replace_all(rows)
+        print(f"🗂️ Rebuilt session catalog: {count} sessions.")
+        return count
+
+    def _turn_record(self, turn: Dict) -> Dict:
+        return {
+            "question": turn["question"],
+            "answer": turn["answer"],
+            "sources": [
+                {key: source[key] for key in SOURCE_FIELDS if key in source}
+                for source in turn.get("sources", [])
+            ],
+            "time": turn.get("time") or datetime.now(timezone.utc).isoformat()
+        }
 
     def record_turn(self, question: str, answer: str, sources: List[Dict]):
-        self.history.append({
-            "question": question,
-            "answer": answer,
-            "sources": sources
-        })
+        turn = self._turn_record({"question": question, "answer": answer, "sources": sources})
+        self.history.append(turn)
+        with open(self.session_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(turn, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.turns += 1
+        self.metadata["modified"] = turn["time"]
+        if not self.registered:
+            self.preview = question
+            self._update_metadata()
+        else:
+            self.catalog.record_turn(self.session_id, turn["time"])
 
     def save_snapshot(self):
-        if not self.session_path:
-            self.session_path = os.path.join(self.session_dir, f"{self.session_id}.json")
-
+        # Turns are already on disk; this only stamps the session as modified.
+        if not self.registered:
+            return
         self.metadata["modified"] = datetime.now(timezone.utc).isoformat()
-        data = {
-            "metadata": self.metadata,
-            "history": self.history
-        }
-
-        with open(self.session_path, "w") as f:
-            json.dump(data, f, indent=2)
-            
-        self.sessions_meta[self.session_id] = self.metadata
-        self.alias_map[self.metadata["alias"]] = self.session_id
-        self._save_json(self.session_file, self.sessions_meta)
-        self._save_json(self.alias_file, self.alias_map)
-
-        # Update metadata record
-        self.sessions_meta[self.session_id] = self.metadata
-        self._save_json(self.session_file, self.sessions_meta)
+        self._update_metadata()
         print(f"💾 Snapshot saved to: {self.session_path}")
+
+    def _read_log(self, path: str, repair: bool = False, last: Optional[int] = None) -> List[Dict]:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = deque(f, maxlen=last)
+        # A crash mid-append leaves a torn last line; drop it, and with
+        # `repair` rewrite the log so new turns aren't appended onto it.
+        if lines and not lines[-1].endswith("\n"):
+            lines.pop()
+            if repair:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._write_atomic(path, "".join(f.readlines()[:-1]))
+        history = []
+        for line in lines:
+            try:
+                history.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        return history
+
+    def _migrate(self, session_id: str) -> Dict:
+        # Converts a legacy <id>.json snapshot into <id>.jsonl, dropping the
+        # chunk text stored with each source.
+        with self.metadata_lock:
+            sessions = self._load_json(self.session_file)
+            meta = sessions.get(session_id) or {"file": self.catalog.resolve(session_id)["file"]}
+            legacy_path = meta["file"]
+            if not legacy_path.endswith(".json"):
+                return meta
+            with open(legacy_path, "r") as f:
+                history = json.load(f).get("history", [])
+            log_path = os.path.splitext(legacy_path)[0] + ".jsonl"
+            self._write_atomic(log_path, "".join(
+                json.dumps(self._turn_record(turn), ensure_ascii=False) + "\n" for turn in history
+            ))
+            meta["file"] = log_path
+            if session_id in sessions:
+                self._save_json(self.session_file, sessions)
+            self.catalog.set_file(session_id, log_path)
+            os.remove(legacy_path)
+        return meta
+
+    def compact(self):
+        for session_id, meta in self._load_json(self.session_file).items():
+            if not str(meta.get("file", "")).endswith(".json") or not os.path.exists(meta["file"]):
+                continue
+            try:
+                self._migrate(session_id)
+            except Exception:
+                continue
@@ -1,9 +1,62 @@
+import time
 import yaml
 import hashlib
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from itertools import islice
+from typing import Iterable, Iterator, List
 
 def load_config(config_path="config.yaml"):
     with open(config_path) as f:
         return yaml.safe_load(f)
 
 def compute_sha1(text: str) -> str:
-    return hashlib.sha1(text.encode("utf-8")).hexdigest()
\ No newline at end of file
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def compute_file_sha1(path: str, block_size: int = 1 << 20) -> str:
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def can_start_process_pool() -> bool:
+    # Workers never start pools of their own; callers run in-process there.
+    # Every entry script keeps its work behind a __main__ guard, so spawned
+    # workers can re-import it safely.
+    return multiprocessing.parent_process() is None
+
+def batched(items: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class StartupProfiler:
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.origin = time.perf_counter()
+        self.phases = []
+        self.lock = threading.Lock()
+
+    def add(self, name: str, start: float, end: float) -> None:
+        with self.lock:
+            self.phases.append((name, start - self.origin, end - start))
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter())
+
+    def report(self) -> None:
+        if not self.enabled:
+            return
+        total = time.perf_counter() - self.origin
+        print("\n⏱️ Startup profile (start offset, duration):")
+        for name, offset, duration in sorted(self.phases, key=lambda phase: phase[1]):
+            print(f"   {offset:7.2f}s  {duration:7.2f}s  {name}")
+        print(f"   ready after {total:.2f}s\n")
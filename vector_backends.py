@@ -0,0 +1,97 @@
+import os
+from typing import Dict, List
+
+CHROMA_SIDE_FILES = ("chunk_ids.sqlite3", "bm25.sqlite3", "dedup.sqlite3", "ingest_manifest.json")
+
+
+class ChromaBackend:
+    # VectorstoreManager writes through these few calls; `store` is the
+    # LangChain vectorstore handed to retrievers.
+    name = "chroma"
+
+    def __init__(self, path: str, embedding_function, **kwargs):
+        from langchain.vectorstores import Chroma
+        self.path = path
+        self.store = Chroma(persist_directory=path, embedding_function=embedding_function)
+
+    def count(self) -> int:
+        return self.store._collection.count()
+
+    def upsert(self, ids, embeddings, metadatas, documents) -> None:
+        self.store._collection.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents)
+
+    def update_metadata(self, ids: List[str], metadatas: List[Dict]) -> None:
+        # Chroma merges updated metadata keys into the stored ones.
+        self.store._collection.update(ids=ids, metadatas=metadatas)
+
+    def delete(self, ids: List[str]) -> None:
+        self.store.delete(ids=ids)
+
+    def get(self, **kwargs) -> Dict[str, list]:
+        return self.store.get(**kwargs)
+
+    def search_ids(self, embeddings, k: int) -> List[List[str]]:
+        return self.store._collection.query(query_embeddings=embeddings, n_results=k, include=[])["ids"]
+
+    def memory_report(self) -> Dict[str, int]:
+        # Chroma keeps each HNSW segment (float32 vectors plus graph) in RAM;
+        # those live in the per-collection subdirectories.
+        disk = ram = 0
+        for root, dirs, names in os.walk(self.path):
+            dirs[:] = [d for d in dirs if d != "ann"]
+            for name in names:
+                if root == self.path and name in CHROMA_SIDE_FILES:
+                    continue
+                size = os.path.getsize(os.path.join(root, name))
+                disk += size
+                if root != self.path:
+                    ram += size
+        return {"disk_bytes": disk, "ram_bytes": ram, "live": self.count()}
+
+    def close(self) -> None:
+        pass
+
+
+class LocalANNBackend:
+    name = "local_ann"
+
+    def __init__(self, path: str, embedding_function, nprobe: int = 16, rerank: int = 64, **kwargs):
+        from local_ann import LocalANNStore
+        self.path = path
+        self.store = LocalANNStore(os.path.join(path, "ann"), embedding_function, nprobe=nprobe, rerank=rerank)
+
+    def count(self) -> int:
+        return self.store.count()
+
+    def upsert(self, ids, embeddings, metadatas, documents) -> None:
+        self.store.upsert(ids, embeddings, metadatas, documents)
+
+    def update_metadata(self, ids: List[str], metadatas: List[Dict]) -> None:
+        self.store.update_metadata(ids, metadatas)
+
+    def delete(self, ids: List[str]) -> None:
+        self.store.delete(ids=ids)
+
+    def get(self, **kwargs) -> Dict[str, list]:
+        return self.store.get(**kwargs)
+
+    def search_ids(self, embeddings, k: int) -> List[List[str]]:
+        return [[doc.metadata.get("id") for doc in docs] for docs in self.store.search_batch(embeddings, k)]
+
+    def memory_report(self) -> Dict[str, int]:
+        return self.store.memory_report()
+
+    def close(self) -> None:
+        self.store.close()
+
+
+BACKENDS = {backend.name: backend for backend in (ChromaBackend, LocalANNBackend)}
+
+
+def create_backend(config: dict, path: str, embedding_function, name: str = None):
+    vs_config = config.get("vectorstore", {})
+    name = name or vs_config.get("backend", "chroma")
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown vectorstore backend {name!r}; choose one of {sorted(BACKENDS)}.")
+    options = {key: vs_config[key] for key in ("nprobe", "rerank") if key in vs_config}
+    return BACKENDS[name](path, embedding_function, **options)
@@ -1,63 +1,515 @@
+from __future__ import annotations
+
 import os
+import json
+import time
+import queue
 import shutil
-from typing import List, Set
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 from tqdm import tqdm
-from langchain.docstore.document import Document
-from langchain.vectorstores import Chroma
-from langchain.embeddings import HuggingFaceEmbeddings
+from utils import batched, can_start_process_pool
+from chunk_index import ChunkIdIndex, source_of
+
+# langchain, chromadb and sentence-transformers are imported on first use so
+# that commands like --delete start instantly.
+if TYPE_CHECKING:
+    from langchain.docstore.document import Document
+
+BATCH_SIZE = 256
+REBUILD_PAGE = 10_000
+
+_worker_embeddings = None
+
+
+def _init_embedding_worker(model_name: str, torch_threads: int) -> None:
+    global _worker_embeddings
+    try:
+        import torch
+        torch.set_num_threads(torch_threads)
+    except ImportError:
+        pass
+    from langchain.embeddings import HuggingFaceEmbeddings
+    _worker_embeddings = HuggingFaceEmbeddings(model_name=model_name)
+
+
+def _embed_in_worker(texts: List[str]) -> List[List[float]]:
+    return _worker_embeddings.embed_documents(texts)
 
 
 class VectorstoreManager:
     def __init__(self, config: dict):
         self.config = config
         self.chroma_path = self.config.get("vector_db_path", "./vector_db")
-        model_name = self.config.get("embedding", {}).get("model_name", "all-MiniLM-L6-v2")
-        self.embedding_function = HuggingFaceEmbeddings(model_name=model_name)
+        self.data_path = self.config.get("data_path", "./data")
+        embedding_config = self.config.get("embedding", {})
+        self.model_name = model_name = embedding_config.get("model_name", "all-MiniLM-L6-v2")
+        self.batch_size = embedding_config.get("batch_size", 64)
+        self.workers = embedding_config.get("workers", 1)
+        self.queue_size = embedding_config.get("queue_size", 4)
+        self.embedding_model = None
+        self.embedding_cache = None
+        self._embedding_function = None
+        self.backend = None
         self.vs = None
+        self.id_index = None
+        self.lexical_index = None
+        self.dedup_index = None
+        self.retrieval = self.config.get("retrieval", {})
+        self.dedup = self.config.get("dedup", {})
+        self.listeners: List[Callable[[List[Document], List[str]], None]] = []
+
+    @property
+    def embedding_function(self):
+        # Built on first use; the model itself loads on the first embed call
+        # or in the background via warm_up().
+        if self._embedding_function is None:
+            from embedding_cache import EmbeddingCache, CachedEmbeddings, LazyEmbeddings
+            embedding_config = self.config.get("embedding", {})
+            self.embedding_model = LazyEmbeddings(self.model_name)
+            embedding_function = self.embedding_model
+
+            # Embeddings keyed by chunk text hash survive --reset and renames.
+            cache_path = embedding_config.get("cache_path")
+            if cache_path:
+                self.embedding_cache = EmbeddingCache(
+                    cache_path, max_entries=embedding_config.get("cache_max_entries", 500_000)
+                )
+                embedding_function = CachedEmbeddings(embedding_function, self.embedding_cache, self.model_name)
+            self._embedding_function = embedding_function
+        return self._embedding_function
+
+    def warm_up(self) -> None:
+        self.embedding_function
+        self.embedding_model.load_async()
 
     def load_vectorstore(self) -> None:
-        self.vs = Chroma(persist_directory=self.chroma_path, embedding_function=self.embedding_function)
+        # vectorstore.backend picks where vectors live (see vector_backends);
+        # the chunk ID and BM25 indexes sit next to it either way.
+        from vector_backends import create_backend
+        self.backend = create_backend(self.config, self.chroma_path, self.embedding_function)
+        self.vs = self.backend.store
+        self.id_index = ChunkIdIndex(os.path.join(self.chroma_path, "chunk_ids.sqlite3"), self.data_path)
+        if self.id_index.is_empty() and self.backend.count():
+            self._rebuild_id_index()
+        if self.id_index.has_legacy_sources():
+            self._rekey_id_index()
+        if self.retrieval.get("mode", "dense") == "hybrid":
+            from bm25_index import BM25Index
+            self.lexical_index = BM25Index(os.path.join(self.chroma_path, "bm25.sqlite3"))
+            if self.lexical_index.is_empty() and self.backend.count():
+                self._rebuild_lexical_index()
+            self.add_listener(self.lexical_index.update)
+        if self.dedup.get("enabled", False):
+            from dedup_index import DedupIndex
+            self.dedup_index = DedupIndex(
+                os.path.join(self.chroma_path, "dedup.sqlite3"),
+                threshold=self.dedup.get("threshold", 0.9),
+                num_perm=self.dedup.get("num_perm", 128),
+                bands=self.dedup.get("bands", 16),
+                shingle=self.dedup.get("shingle", 5),
+            )
+            if self.dedup_index.is_empty() and self.backend.count():
+                self._rebuild_dedup_index()
+        self._check_id_index()
+
+    def as_retriever(self):
+        k = self.retrieval.get("k", 3)
+        if self.lexical_index is None:
+            return self.vs.as_retriever(search_kwargs={"k": k})
+        from hybrid_retriever import HybridRetriever
+        return HybridRetriever(
+            vectorstore=self.vs, index=self.lexical_index, k=k,
+            rrf_k=self.retrieval.get("rrf_k", 60),
+            search_kwargs={"k": self.retrieval.get("fetch_k", 20)},
+        )
 
-    def add_documents(self, chunks: List[Document]) -> None:
+    def add_listener(self, listener: Callable[[List[Document], List[str]], None]) -> None:
+        # Listeners are called with (added_chunks, removed_ids) after every
+        # batch written to or deleted from the store.
+        self.listeners.append(listener)
+
+    def _notify(self, added: List[Document], removed: List[str]) -> None:
+        for listener in self.listeners:
+            listener(added, removed)
+
+    def _rebuild_id_index(self) -> None:
+        # One-off migration for stores created before the ID index existed.
+        print("🗂️ Building chunk ID index from the vectorstore...")
+        offset = 0
+        while True:
+            page = self.backend.get(include=["metadatas"], limit=REBUILD_PAGE, offset=offset)
+            if not page["ids"]:
+                break
+            self.id_index.add(
+                (chunk_id, source_of({"file": ChunkIdIndex.file_of(chunk_id), **(metadata or {})}, self.data_path))
+                for chunk_id, metadata in zip(page["ids"], page["metadatas"])
+            )
+            offset += len(page["ids"])
+
+    def _rekey_id_index(self) -> None:
+        # Migration for indexes keyed by file name: chunks the ingestion
+        # manifest knows are re-keyed by the path it tracks them under. Until
+        # a manifest exists the index stays marked for migration, except
+        # when there is nothing in it to migrate.
+        from ingest_manifest import IngestManifest
+        sources = list(IngestManifest(self.config).chunk_sources())
+        if sources or self.id_index.is_empty():
+            self.id_index.set_sources(sources)
+
+    def _check_id_index(self) -> None:
+        # The ID index must list exactly the stored chunks plus dedup
+        # references; otherwise sync skips chunks the store lacks. That
+        # happens after switching vectorstore.backend without --migrate, or
+        # after a crash between a store write and the index update.
+        stored = self.backend.count()
+        duplicates = self.dedup_index.stats()["duplicates"] if self.dedup_index is not None else 0
+        indexed = self.id_index.count()
+        if indexed == stored + duplicates:
+            return
+        if not stored:
+            raise RuntimeError(
+                f"The {self.backend.name} vectorstore in {self.chroma_path} is empty, but its chunk ID index lists "
+                f"{indexed} chunks. Configure the previous vectorstore.backend and run --migrate {self.backend.name}, "
+                "or run --reset to re-ingest everything."
+            )
+        print(f"⚠️ Chunk ID index lists {indexed - duplicates} chunks but the {self.backend.name} vectorstore "
+              f"holds {stored}. Rebuilding the index; run --sync to re-ingest anything missing.")
+        self.id_index.clear()
+        self._rebuild_id_index()
+        if self.dedup_index is not None:
+            self.id_index.add(self.dedup_index.duplicate_sources(self.data_path))
+        self._rekey_id_index()
+
+    def _rebuild_lexical_index(self) -> None:
+        # First hybrid run on an existing store: index the chunks already in Chroma.
+        print("🔤 Building BM25 index from the vectorstore...")
+        offset = 0
+        while True:
+            page = self.backend.get(include=["documents"], limit=REBUILD_PAGE, offset=offset)
+            if not page["ids"]:
+                break
+            self.lexical_index.add(zip(page["ids"], page["documents"]))
+            offset += len(page["ids"])
+
+    def _rebuild_dedup_index(self) -> None:
+        # Chunks stored before dedup was enabled become canonicals as they are.
+        print("🧬 Building duplicate index from the vectorstore...")
+        offset = 0
+        while True:
+            page = self.backend.get(include=["documents"], limit=REBUILD_PAGE, offset=offset)
+            if not page["ids"]:
+                break
+            self.dedup_index.add(zip(page["ids"], page["documents"]))
+            offset += len(page["ids"])
+
+    def add_documents(self, chunks: Iterable[Document]) -> None:
         if self.vs is None:
             self.load_vectorstore()
 
-        try:
-            store_data = self.vs.get(include=["ids"])
-            existing_ids = set(store_data["ids"])
-        except Exception:
-            existing_ids = set()
-
-        new_chunks, new_ids = [], []
-        for doc in tqdm(chunks, desc="🔄 Adding chuncked documents"):
-            doc_id = doc.metadata.get("id")
-            if doc_id and doc_id not in existing_ids:
-                new_chunks.append(doc)
-                new_ids.append(doc_id)
-
-        if new_chunks:
-            print(f"🆕 Added {len(new_chunks)} new document chuncks to the knowledge base.")
-            self.vs.add_documents(new_chunks, ids=new_ids)
+        new_chunks = (
+            doc for doc in chunks
+            if doc.metadata.get("id") and doc.metadata["id"] not in self.id_index
+        )
+
+        added = self._write_chunks(new_chunks)
+        if added:
+            print(f"🆕 Added {added} new document chuncks to the knowledge base.")
         else:
             print("✅ Your knowledge base is already up to date.")
             
+    def sync_documents(self, chunks: Iterable[Document], files: Optional[Iterable[str]] = None) -> Dict[str, int]:
+        # Makes the stored chunks of each source file match `chunks` exactly.
+        # Files are keyed by the manifest path they were loaded from (see
+        # chunk_index.source_of). With `files`, only those files (plus any
+        # present in `chunks`) are synced; otherwise every file in the store
+        # is, so vanished files are purged. `chunks` may be a lazy stream;
+        # `files` is read once it is consumed.
+        if self.vs is None:
+            self.load_vectorstore()
+
+        stored = self.id_index.ids_by_source() if files is None else {}
+        seen: Dict[str, Set[str]] = {}
+        embedded: Dict[str, int] = {}
+        dedup: Dict = {}
+
+        def new_chunks():
+            for doc in chunks:
+                file, doc_id = source_of(doc.metadata), doc.metadata["id"]
+                if file not in seen:
+                    seen[file] = set()
+                    if file not in stored:
+                        stored[file] = self.id_index.ids_by_source([file]).get(file, set())
+                if doc_id in seen[file]:
+                    continue
+                seen[file].add(doc_id)
+                if doc_id not in stored[file]:
+                    embedded[file] = embedded.get(file, 0) + 1
+                    yield doc
+
+        added = self._write_chunks(new_chunks(), dedup)
+
+        if files is not None:
+            stored.update(self.id_index.ids_by_source(set(files) - set(stored)))
+        # A chunk ID still produced by any file is kept, even if it was last
+        # stored under another one.
+        all_seen = set().union(*seen.values())
+        to_remove, unchanged, file_reports = [], 0, {}
+        for file, stored_ids in stored.items():
+            current_ids = seen.get(file, set())
+            removed_ids = sorted(stored_ids - current_ids - all_seen)
+            reused = len(stored_ids & current_ids)
+            to_remove.extend(removed_ids)
+            unchanged += reused
+            if removed_ids or embedded.get(file):
+                duplicates = dedup.get("files", {}).get(file, 0)
+                file_reports[file] = {
+                    "reused": reused, "embedded": embedded.get(file, 0) - duplicates,
+                    "deduplicated": duplicates, "removed": len(removed_ids),
+                }
+        for batch in batched(to_remove, BATCH_SIZE):
+            self._delete_chunks(batch)
+
+        report = {"added": added, "removed": len(to_remove), "unchanged": unchanged, "files": file_reports}
+        for file, counts in sorted(file_reports.items()):
+            print(f"   📄 {file}: {counts['reused']} chunks reused, {counts['embedded']} re-embedded, "
+                  + (f"{counts['deduplicated']} deduplicated, " if counts["deduplicated"] else "")
+                  + f"{counts['removed']} removed")
+        print(f"🔁 Synced knowledge base: {report['added']} added, "
+              f"{report['removed']} removed, {report['unchanged']} unchanged chunks.")
+        return report
+
+    def _write_chunks(self, chunks: Iterable[Document], dedup: Optional[Dict] = None) -> int:
+        # Embeds in batches of `embedding.batch_size` and writes each batch to
+        # the store as soon as its vectors are ready. Batches are produced on a
+        # background thread into a bounded queue, so loading and splitting
+        # overlap with embedding and memory stays proportional to batch size.
+        # With dedup enabled, duplicates are dropped before embedding and their
+        # stats land in `dedup`.
+        start = time.perf_counter()
+        written = 0
+        dedup = {} if dedup is None else dedup
+        if self.dedup_index is not None:
+            chunks = self.dedup_index.filter(chunks, dedup)
+        with tqdm(desc="🧠 Embedding chunks", unit="chunk") as progress:
+            for batch, vectors in self._iter_embedded(self._iter_batches(chunks)):
+                self.backend.upsert(
+                    ids=[doc.metadata["id"] for doc in batch],
+                    embeddings=vectors,
+                    metadatas=[doc.metadata for doc in batch],
+                    documents=[doc.page_content for doc in batch],
+                )
+                self.id_index.add((doc.metadata["id"], source_of(doc.metadata)) for doc in batch)
+                self._notify(batch, [])
+                written += len(batch)
+                progress.update(len(batch))
+        elapsed = time.perf_counter() - start
+        if written:
+            print(f"⚡ Embedded {written} chunks in {elapsed:.1f}s "
+                  f"({written / max(elapsed, 1e-9):.1f} chunks/s).")
+            self._report_cache()
+        if dedup.get("chunks"):
+            # Duplicates count as stored, so later syncs track and remove them.
+            self.id_index.add(dedup["chunks"])
+            self._refresh_references(dedup["touched"])
+            self._report_dedup(dedup, written, elapsed)
+        return written
+
+    def _delete_chunks(self, chunk_ids: List[str]) -> None:
+        stored, touched = chunk_ids, set()
+        if self.dedup_index is not None:
+            stored, promotions, touched = self.dedup_index.remove(chunk_ids)
+            if promotions:
+                self._promote(promotions)
+        if stored:
+            self.backend.delete(stored)
+        self.id_index.remove(chunk_ids)
+        self._notify([], chunk_ids)
+        self._refresh_references(touched)
+
+    def _promote(self, promotions: Dict[str, Tuple[str, Dict]]) -> None:
+        # A removed canonical's first duplicate takes its place, reusing the
+        # canonical's vector since the texts are (nearly) the same.
+        from langchain.docstore.document import Document
+        found = self.backend.get(ids=list(promotions), include=["embeddings"])
+        vectors = dict(zip(found["ids"], found["embeddings"]))
+        docs, embeddings = [], []
+        for old_id, (text, metadata) in promotions.items():
+            docs.append(Document(page_content=text, metadata=metadata))
+            vector = vectors.get(old_id)
+            embeddings.append(list(vector) if vector is not None else self.embedding_function.embed_documents([text])[0])
+        self.backend.upsert(
+            ids=[doc.metadata["id"] for doc in docs],
+            embeddings=embeddings,
+            metadatas=[doc.metadata for doc in docs],
+            documents=[doc.page_content for doc in docs],
+        )
+        self._notify(docs, [])
+
+    def _refresh_references(self, canonical_ids: Iterable[str]) -> None:
+        # Mirrors each canonical's duplicate list onto its stored metadata.
+        for batch in batched(sorted(canonical_ids), BATCH_SIZE):
+            references = self.dedup_index.references(batch)
+            self.backend.update_metadata(batch, [{"duplicates": json.dumps(references[chunk_id])} for chunk_id in batch])
+
+    def _report_dedup(self, dedup: Dict, written: int, elapsed: float) -> None:
+        # Savings are estimated from this run's embedding rate and the store's
+        # average size per chunk.
+        skipped = len(dedup["chunks"])
+        report = self.backend.memory_report()
+        per_chunk = report["disk_bytes"] / max(report["live"], 1)
+        seconds = skipped * elapsed / written if written else 0.0
+        totals = self.dedup_index.stats()
+        print(f"🧬 Skipped {skipped} duplicate chunks ({dedup['exact']} exact, {dedup['near']} near): "
+              f"~{skipped * per_chunk / 1e6:.1f} MB of index and ~{seconds:.1f}s of embedding saved. "
+              f"Store holds {totals['canonical']} chunks plus {totals['duplicates']} duplicate references.")
+
+    def _iter_batches(self, chunks: Iterable[Document]) -> Iterator[List[Document]]:
+        batches: queue.Queue = queue.Queue(maxsize=self.queue_size)
+
+        def produce():
+            try:
+                for batch in batched(chunks, self.batch_size):
+                    batches.put(batch)
+            except BaseException as e:
+                batches.put(e)
+            batches.put(None)
+
+        threading.Thread(target=produce, daemon=True).start()
+        while (batch := batches.get()) is not None:
+            if isinstance(batch, BaseException):
+                raise batch
+            yield batch
+
+    def _iter_embedded(self, batches: Iterator[List[Document]]) -> Iterator[Tuple[List[Document], List[List[float]]]]:
+        if self.workers <= 1 or not can_start_process_pool():
+            for batch in batches:
+                yield batch, self.embedding_function.embed_documents([doc.page_content for doc in batch])
+            return
+
+        # Cache lookups stay in this process; only misses go to the pool.
+        # At most two batches per worker are in flight, and results are
+        # yielded in submission order. Workers are spawned: torch may already
+        # be loading on a background thread here, and forking that can hang.
+        torch_threads = max(1, (os.cpu_count() or 1) // self.workers)
+        pending = deque()
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_embedding_worker,
+            initargs=(self.model_name, torch_threads),
+        ) as pool:
+            for batch in batches:
+                texts = [doc.page_content for doc in batch]
+                if self.embedding_cache is not None:
+                    vectors = self.embedding_cache.get_many(self.model_name, texts)
+                else:
+                    vectors = [None] * len(texts)
+                missing = [text for text, vector in zip(texts, vectors) if vector is None]
+                future = pool.submit(_embed_in_worker, missing) if missing else None
+                pending.append((batch, vectors, missing, future))
+                if len(pending) >= self.workers * 2:
+                    yield self._collect_batch(*pending.popleft())
+            while pending:
+                yield self._collect_batch(*pending.popleft())
+
+    def _collect_batch(self, batch, vectors, missing, future) -> Tuple[List[Document], List[List[float]]]:
+        if future is not None:
+            computed = future.result()
+            if self.embedding_cache is not None:
+                self.embedding_cache.put_many(self.model_name, missing, computed)
+            remaining = iter(computed)
+            vectors = [vector if vector is not None else next(remaining) for vector in vectors]
+        return batch, vectors
+
+    def _report_cache(self) -> None:
+        if self.embedding_cache is not None:
+            stats = self.embedding_cache.stats()
+            print(f"🧮 Embedding cache: {stats['hits']} hits, {stats['misses']} misses "
+                  f"({stats['hit_rate']:.0%} hit rate, {stats['entries']} entries).")
+
+    def migrate(self, target: str) -> None:
+        # Copies every stored vector, text and metadata into another backend
+        # without re-embedding, then compares the two.
+        from vector_backends import create_backend
+        if self.vs is None:
+            self.load_vectorstore()
+        if target == self.backend.name:
+            print(f"⚠️ Vectorstore already uses the {target} backend.")
+            return
+        destination = create_backend(self.config, self.chroma_path, self.embedding_function, name=target)
+        offset = 0
+        with tqdm(total=self.backend.count(), desc=f"📦 Migrating to {target}", unit="chunk") as progress:
+            while True:
+                page = self.backend.get(include=["embeddings", "documents", "metadatas"], limit=REBUILD_PAGE, offset=offset)
+                if not len(page["ids"]):
+                    break
+                for start in range(0, len(page["ids"]), BATCH_SIZE):
+                    end = start + BATCH_SIZE
+                    destination.upsert(
+                        ids=list(page["ids"][start:end]),
+                        embeddings=page["embeddings"][start:end],
+                        metadatas=list(page["metadatas"][start:end]),
+                        documents=list(page["documents"][start:end]),
+                    )
+                    progress.update(len(page["ids"][start:end]))
+                offset += len(page["ids"])
+        self.compare_backends(destination)
+        print(f"✅ Migrated {destination.count()} chunks. Set `vectorstore.backend: {target}` in config.yaml to use it.")
+
+    def compare_backends(self, other, samples: int = 200, k: int = 10) -> None:
+        # Queries both backends with stored vectors plus a little noise and
+        # reports memory, latency and recall@k of `other` against the current one.
+        import numpy as np
+        total = self.backend.count()
+        if not total:
+            return
+        rng = np.random.default_rng(0)
+        offset = int(rng.integers(0, max(1, total - samples)))
+        vectors = np.asarray(self.backend.get(include=["embeddings"], limit=samples, offset=offset)["embeddings"], dtype=np.float32)
+        noise = rng.normal(scale=0.05 * float(np.abs(vectors).mean()), size=vectors.shape).astype(np.float32)
+        queries = (vectors + noise).tolist()
+
+        results = {}
+        for backend in (self.backend, other):
+            start = time.perf_counter()
+            results[backend.name] = [backend.search_ids([query], k)[0] for query in queries]
+            elapsed = (time.perf_counter() - start) / len(queries)
+            report = backend.memory_report()
+            print(f"📊 {backend.name}: {report['disk_bytes'] / 1e6:.1f} MB on disk, "
+                  f"~{report['ram_bytes'] / 1e6:.1f} MB resident, {elapsed * 1000:.2f} ms/query")
+        recall = np.mean([
+            len(set(a) & set(b)) / max(len(a), 1)
+            for a, b in zip(results[self.backend.name], results[other.name])
+        ])
+        print(f"🎯 Recall@{k} of {other.name} against {self.backend.name}: {recall:.3f} over {len(queries)} queries")
+
     def needs_update(self, chunks: List[Document]) -> bool:
         if self.vs is None:
             return True
-        try:
-            store_data = self.vs.get(include=["metadatas"])
-            existing_ids = {
-                meta.get("id") for meta in store_data["metadatas"]
-                if meta.get("id") is not None
-            }
-        except Exception:
-            return True
-
-        new_ids = {doc.metadata["id"] for doc in chunks}
-        return not existing_ids.issuperset(new_ids)
+        return bool(self.id_index.missing(doc.metadata["id"] for doc in chunks))
 
+    def close(self) -> None:
+        # Releases the store and side index handles; load_vectorstore() reopens them.
+        if self.id_index is not None:
+            self.id_index.close()
+            self.id_index = None
+        if self.lexical_index is not None:
+            self.lexical_index.close()
+            self.listeners.remove(self.lexical_index.update)
+            self.lexical_index = None
+        if self.dedup_index is not None:
+            self.dedup_index.close()
+            self.dedup_index = None
+        if self.backend is not None:
+            self.backend.close()
+            self.backend = self.vs = None
 
     def delete_vectorstore(self) -> None:
+        self.close()
         if os.path.exists(self.chroma_path):
             shutil.rmtree(self.chroma_path)
             print(f"🗑️ Deleted vectorstore at {self.chroma_path}")